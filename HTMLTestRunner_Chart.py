@@ -100,18 +100,46 @@ Version in 0.7.1
 # TODO: color stderr
 # TODO: simplify javascript using ,ore than 1 class in the class attribute?
 
+import ast
+import base64
+import binascii
 import datetime
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
+import re
+import socket
 import sys
+import tempfile
+import threading
+import time
 import unittest
+import zlib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+    from multiprocessing.connection import wait as _wait_connections
+except ImportError:
+    # python 2
+    _wait_connections = None
 from xml.sax import saxutils
 
 PY3K = (sys.version_info[0] > 2)
 if PY3K:
     import io as StringIO
+    import queue as Queue
 else:
     import StringIO
+    import Queue
 import copy
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # ------------------------------------------------------------------------
 # The redirectors below are used to capture output during testing. Output
 # sent to sys.stdout and sys.stderr are automatically captured. However
@@ -122,27 +150,301 @@ import copy
 # e.g.
 #   >>> logging.basicConfig(stream=HTMLTestRunner.stdout_redirector)
 #   >>>
+#
+# Each thread can bind its own buffer, so tests running concurrently in a
+# thread pool capture their output separately. Threads without a bound
+# buffer write to fp.
 
 
 class OutputRedirector(object):
     """ Wrapper to redirect stdout or stderr """
     def __init__(self, fp):
         self.fp = fp
+        self._local = threading.local()
+
+    def bind(self, fp):
+        """ Redirect writes made by the calling thread to fp """
+        self._local.fp = fp
+
+    def unbind(self):
+        self._local.fp = None
+
+    def _stream(self):
+        fp = getattr(self._local, 'fp', None)
+        if fp is None:
+            return self.fp
+        return fp
 
     def write(self, s):
-        self.fp.write(s)
+        self._stream().write(s)
 
     def writelines(self, lines):
-        self.fp.writelines(lines)
+        self._stream().writelines(lines)
 
     def flush(self):
-        self.fp.flush()
+        self._stream().flush()
 
 
 stdout_redirector = OutputRedirector(sys.stdout)
 stderr_redirector = OutputRedirector(sys.stderr)
 
 
+class _OutputBuffer(object):
+    """
+    Capture buffer for the output of one test.
+
+    Without a limit it behaves like a StringIO. With one, at most limit
+    characters are kept in memory: the first half of the output and a
+    rolling window over its end, and getvalue() returns them joined by a
+    truncation marker. If spill_dir is set, the complete output also goes
+    to a log file there once the limit is passed; its path is in log_path.
+    """
+
+    def __init__(self, limit=None, spill_dir=None):
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self._buf = StringIO.StringIO()
+        self.reset()
+
+    def reset(self, name='output'):
+        self.close()
+        self._buf.seek(0)
+        self._buf.truncate()
+        self.name = name
+        self.size = 0
+        self.truncated = False
+        self.head = u''
+        self._tail = []
+        self._tail_size = 0
+        self.log_path = None
+        self._log = None
+
+    def write(self, s):
+        if not self.truncated and (self.limit is None or self.size + len(s) <= self.limit):
+            self._buf.write(s)
+            self.size += len(s)
+            return
+        if not self.truncated:
+            self._overflow()
+        self.size += len(s)
+        if self._log is not None:
+            self._log.write(s)
+        self._tail.append(s)
+        self._tail_size += len(s)
+        keep = self.limit - len(self.head)
+        if self._tail_size > 2 * keep:
+            tail = u''.join(self._tail)[-keep:]
+            self._tail = [tail]
+            self._tail_size = len(tail)
+
+    def _overflow(self):
+        """ Switch from the plain buffer to head + tail (+ log file) """
+        self.truncated = True
+        value = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        self.head = value[:self.limit // 2]
+        self._tail = [value[self.limit // 2:]]
+        self._tail_size = len(self._tail[0])
+        if self.spill_dir is not None:
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+            fd, self.log_path = tempfile.mkstemp(prefix=self.name + '-', suffix='.log', dir=self.spill_dir)
+            self._log = io.open(fd, 'w', encoding='utf-8', errors='replace')
+            self._log.write(value)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self):
+        """ Close the spill file; what is in memory stays readable """
+        log = getattr(self, '_log', None)
+        if log is not None:
+            log.close()
+            self._log = None
+
+    def getvalue(self):
+        if not self.truncated:
+            return self._buf.getvalue()
+        tail = u''.join(self._tail)[-(self.limit - len(self.head)):]
+        omitted = self.size - len(self.head) - len(tail)
+        return u'%s\n...... [省略 %d 个字符] ......\n%s' % (self.head, omitted, tail)
+
+
+# ----------------------------------------------------------------------
+# Screenshots
+
+
+class ScreenshotEncoder(object):
+    """
+    Pass-through screenshot encoder, and the base class for encoders.
+
+    encode() gets the image bytes from the driver and returns the bytes to
+    store. thumbnail() returns a small rendition, used once the report's
+    screenshot budget is spent, or None if it cannot make one.
+    """
+
+    def encode(self, data):
+        return data
+
+    def thumbnail(self, data):
+        return None
+
+
+class PillowEncoder(ScreenshotEncoder):
+    """ Downscale screenshots to max_size and recompress them as JPEG, using Pillow """
+
+    def __init__(self, max_size=(1280, 1280), quality=70, thumbnail_size=(320, 320)):
+        if Image is None:
+            raise ImportError('PillowEncoder requires Pillow: pip install pillow')
+        self.max_size = max_size
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+
+    def _jpeg(self, data, size, quality):
+        img = Image.open(io.BytesIO(data))
+        # thumbnail() keeps the aspect ratio and never enlarges
+        img.thumbnail(size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True)
+        return out.getvalue()
+
+    def encode(self, data):
+        return self._jpeg(data, self.max_size, self.quality)
+
+    def thumbnail(self, data):
+        return self._jpeg(data, self.thumbnail_size, min(self.quality, 50))
+
+
+class _ScreenshotJob(object):
+    def __init__(self, driver, imgs, slot):
+        self.driver = driver
+        self.imgs = imgs
+        self.slot = slot
+        self.captured = threading.Event()
+        self.done = threading.Event()
+
+
+class ScreenshotService(object):
+    """
+    Take screenshots on a small pool of worker threads.
+
+    The test thread waits for the browser to hand over the image, at most
+    ``timeout`` seconds, so a hung driver cannot stall the suite; any
+    processing of the image happens in the background afterwards. The wait
+    is deliberate: the page must be captured as it was when the test failed
+    and before tearDown may quit the driver, so a slow driver still slows
+    the test down by the time the screenshot itself takes. Each
+    capture reserves its slot in test.imgs up front so screenshots keep
+    their order, and drain() waits for outstanding jobs before the report
+    is rendered. Slots of captures that never finished stay None and are
+    left out of the report. The images are passed through encoder
+    (a ScreenshotEncoder) on the worker.
+    """
+
+    def __init__(self, workers=2, queue_size=32, timeout=10, encoder=None):
+        self.timeout = timeout
+        self.encoder = encoder or ScreenshotEncoder()
+        self._queue = Queue.Queue(queue_size)
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._workers = workers
+        # a forked child inherits this object but not its threads
+        self.pid = os.getpid()
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def capture(self, driver, imgs):
+        """ Append a screenshot of driver to imgs; return False if it could not be taken in time """
+        imgs.append(None)
+        job = _ScreenshotJob(driver, imgs, len(imgs) - 1)
+        try:
+            self._queue.put(job, timeout=self.timeout)
+        except Queue.Full:
+            sys.stderr.write('Screenshot queue is full, screenshot dropped\n')
+            return False
+        with self._lock:
+            self._jobs.append(job)
+        if not job.captured.wait(self.timeout):
+            sys.stderr.write('Screenshot timed out after %ss\n' % self.timeout)
+            return False
+        return True
+
+    def drain(self, timeout=None):
+        """ Wait for the screenshots taken so far to be stored in their test's imgs """
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            jobs, self._jobs = self._jobs, []
+        for job in jobs:
+            job.done.wait(max(0, deadline - time.time()))
+
+    def shutdown(self):
+        """ Stop idle workers; workers stuck on a hung driver are daemon threads """
+        for _ in range(self._workers):
+            try:
+                self._queue.put_nowait(None)
+            except Queue.Full:
+                break
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                raw = job.driver.get_screenshot_as_base64()
+            except Exception:
+                raw = None
+            job.captured.set()
+            if raw is not None:
+                try:
+                    job.imgs[job.slot] = self.process(raw)
+                except Exception as e:
+                    # keep the screenshot as the driver took it
+                    sys.stderr.write('Screenshot encoding failed, keeping the original: %r\n' % e)
+                    job.imgs[job.slot] = raw
+            job.done.set()
+
+    def process(self, raw):
+        """ Turn a captured base64 screenshot into what goes into test.imgs; runs on a worker """
+        data = self.encoder.encode(base64.b64decode(raw))
+        return base64.b64encode(data).decode('ascii')
+
+
+# the ScreenshotService of the running HTMLTestRunner, if any
+_screenshot_service = None
+
+
+def capture_screenshot(test, driver=None):
+    """
+    Add a screenshot of driver (test.driver by default) to test.imgs, through
+    the runner's ScreenshotService when one is active. Use this from tests
+    instead of appending driver.get_screenshot_as_base64() to test.imgs.
+    """
+    driver = driver or getattr(test, 'driver', None)
+    if not driver:
+        return False
+    if getattr(test, 'imgs', None) is None:
+        test.imgs = []
+    service = _screenshot_service
+    if service is not None:
+        return service.capture(driver, test.imgs)
+    try:
+        test.imgs.append(driver.get_screenshot_as_base64())
+        return True
+    except Exception:
+        return False
+
+
 # ----------------------------------------------------------------------
 # Template
 
@@ -191,6 +493,15 @@ class Template_mixin(object):
         0: u'通过',
         1: u'失败',
         2: u'错误',
+        3: u'未执行',
+    }
+
+    # style of a test row by result code
+    CASE_STYLE = {
+        0: 'passCase',
+        1: 'failCase',
+        2: 'errorCase',
+        3: 'notrunCase',
     }
 
     DEFAULT_TITLE = 'Unit Test Report'
@@ -207,19 +518,34 @@ class Template_mixin(object):
     <meta name="generator" content="%(generator)s"/>
     <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
     <script type="text/javascript" src="%(jsonpath)s" charset="utf-8"></script>
-    <link href="http://cdn.bootcss.com/bootstrap/3.3.0/css/bootstrap.min.css" rel="stylesheet">
-    <script src="https://cdn.bootcss.com/echarts/3.8.5/echarts.common.min.js"></script>
-    <!-- <script type="text/javascript" src="js/echarts.common.min.js"></script> -->
+    %(assets)s
     
     %(stylesheet)s
     
 </head>
 <body>
-    <script language="javascript" type="text/javascript"><!--
+    %(script)s
+
+    <div id="div_base">
+        %(heading)s
+        %(report)s
+        %(ending)s
+        %(chart_script)s
+    </div>
+</body>
+</html>
+"""  # variables: (title, generator, assets, stylesheet, script, heading, report, ending, chart_script)
+
+    # third-party assets linked from a CDN with assets='cdn'; assets='shared'
+    # and 'inline' use local copies given in asset_files instead
+    ASSETS_TMPL = """<link href="http://cdn.bootcss.com/bootstrap/3.3.0/css/bootstrap.min.css" rel="stylesheet">
+    <script src="https://cdn.bootcss.com/echarts/3.8.5/echarts.common.min.js"></script>"""
+
+    # the page script; plain JavaScript, not a % template
+    SCRIPT_TMPL = r"""
     output_list = Array();
 
-    /* level - 0:Summary; 1:Failed; 2:All */
-    console.log(data)
+    /* level - 0:Summary; 1:Failed; 2:Passed; 3:All; 4:Error; 5:Not run */
     function showCase(level) {
         trs = document.getElementsByTagName("tr");
         for (var i = 2; i < trs.length; i++) {
@@ -246,6 +572,13 @@ class Template_mixin(object):
                     tr.className = 'hiddenRow';
                 }
             }
+            if (result === "notrunCase"){
+                if (level === 5 || level === 3){
+                    tr.className = '';
+                }else {
+                    tr.className = 'hiddenRow';
+                }
+            }
         }
 
     }
@@ -260,6 +593,10 @@ class Template_mixin(object):
                 tid = 'p' + tid0;
                 tr = document.getElementById(tid);
             }
+            if (!tr) {
+                tid = 'n' + tid0;
+                tr = document.getElementById(tid);
+            }
             id_list[i] = tid;
             if (tr.className) {
                 toHide = 0;
@@ -277,9 +614,60 @@ class Template_mixin(object):
         }
     }
 
+    /* 点击“耗时”表头，按耗时排序测试类及类中的用例，再次点击反向排序 */
+    var durationDesc = false;
+    function sortByDuration() {
+        durationDesc = !durationDesc;
+        var sign = durationDesc ? -1 : 1;
+        var table = document.getElementById('result_table');
+        var total = document.getElementById('total_row');
+        var trs = table.getElementsByTagName('tr');
+        var groups = [];
+        for (var i = 0; i < trs.length; i++) {
+            var tr = trs[i];
+            if (tr.id === 'header_row' || tr.id === 'total_row') {
+                continue;
+            }
+            if (/^[pfn]t/.test(tr.id)) {
+                if (groups.length) {
+                    groups[groups.length - 1].tests.push(tr);
+                }
+            } else {
+                groups.push({head: tr, tests: []});
+            }
+        }
+        function seconds(tr) {
+            return Number(tr.getAttribute('data-duration')) || 0;
+        }
+        groups.sort(function (a, b) { return sign * (seconds(a.head) - seconds(b.head)); });
+        for (var g = 0; g < groups.length; g++) {
+            groups[g].tests.sort(function (a, b) { return sign * (seconds(a) - seconds(b)); });
+            total.parentNode.insertBefore(groups[g].head, total);
+            for (var k = 0; k < groups[g].tests.length; k++) {
+                total.parentNode.insertBefore(groups[g].tests[k], total);
+            }
+        }
+    }
+
 
     function showTestDetail(div_id){
         var details_div = document.getElementById(div_id);
+        var pending = details_div.querySelector('[data-chunk]');
+        if (pending) {
+            // 压缩模式: 输出在单独的分块文件里，第一次打开时加载；
+            // 去掉data-chunk，加载完成前再次点击不会重复加载
+            var url = pending.getAttribute('data-chunk');
+            pending.removeAttribute('data-chunk');
+            loadChunk(url).then(function (chunk) {
+                if (pending.parentNode) {
+                    pending.outerHTML = chunk[pending.getAttribute('data-key')];
+                }
+            }, function () {
+                // 再次打开时重新加载
+                pending.textContent = '加载失败: ' + url;
+                pending.setAttribute('data-chunk', url);
+            });
+        }
         var displayState = details_div.style.display;
         // alert(displayState)
         if (displayState !== 'block' ) {
@@ -292,10 +680,14 @@ class Template_mixin(object):
     }
 
 
+    /* 转义后可以放进文本和属性(单引号或双引号)里 */
     function html_escape(s) {
+        s = String(s);
         s = s.replace(/&/g,'&amp;');
         s = s.replace(/</g,'&lt;');
         s = s.replace(/>/g,'&gt;');
+        s = s.replace(/"/g,'&quot;');
+        s = s.replace(/'/g,'&#39;');
         return s;
     }
     
@@ -354,7 +746,45 @@ class Template_mixin(object):
         obj.parentElement.style.display = "none";
         obj.parentElement.getElementsByClassName('imgyuan')[0].innerHTML = "";
     }
+    /* 解压gzip+base64的数据(压缩模式的历史记录和输出分块) */
+    function gunzipJSON(b64) {
+        var bytes = Uint8Array.from(atob(b64), function (c) { return c.charCodeAt(0); });
+        var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        return new Response(stream).text().then(JSON.parse);
+    }
+    var chunks = {};
+    /* 分块文件是调用reportChunk的脚本，用<script>加载，直接打开本地文件时也可以用 */
+    function loadChunk(url) {
+        if (!chunks[url]) {
+            var loaded, failed;
+            chunks[url] = new Promise(function (resolve, reject) { loaded = resolve; failed = reject; });
+            chunks[url].loaded = loaded;
+            var script = document.createElement('script');
+            script.src = url;
+            script.onerror = function () {
+                // 文件缺失或无法访问: 让等待的调用方失败，下次调用重新加载
+                delete chunks[url];
+                script.parentNode.removeChild(script);
+                failed(new Error(url));
+            };
+            document.body.appendChild(script);
+        }
+        return chunks[url];
+    }
+    function reportChunk(url, b64) {
+        gunzipJSON(b64).then(chunks[url].loaded);
+    }
     window.onload=function (){
+        if (typeof data_gz !== 'undefined') {
+            gunzipJSON(data_gz).then(function (runs) {
+                data = runs;
+                showHistory();
+            });
+        } else {
+            showHistory();
+        }
+    }
+    function showHistory() {
         var objSelectet = document.getElementById("testTime");
         for(var i = data.length-1 ; i >=0 ; i--){
             var objOption = document.createElement("OPTION");
@@ -362,9 +792,6 @@ class Template_mixin(object):
             objOption.value = i;
             objSelectet.options.add(objOption);
         }
-        let successrate = [];
-        let failrate = [];
-        let errorrate = [];
         for (var j = 0 ; j < data.length; j++){
             if ( data[j]["success"] === undefined) {
                 data[j]["success"] = 0
@@ -375,19 +802,47 @@ class Template_mixin(object):
             if ( data[j]["error"] === undefined) {
                 data[j]["error"] = 0
             }
-            console.log(data[j]["success"], data[j]["fail"],data[j]["error"])
+        }
+        drawTrend();
+    }
+    /* 走势图数据，每项为 [时间段, 运行次数, 通过率, 失败率, 错误率] */
+    function trendData() {
+        var scale = document.getElementById("trendScale").value;
+        if (typeof rollup !== 'undefined' && rollup[scale] !== undefined && rollup[scale].length) {
+            // 生成报告时已按天/按周聚合好
+            return rollup[scale];
+        }
+        var rows = [];
+        for (var j = 0 ; j < data.length; j++){
             let totle = Number(data[j]["success"])+Number(data[j]["fail"])+Number(data[j]["error"]);
-            console.log(totle)
-            successrate.push((Number(data[j]["success"])/totle)*100);
-            failrate.push((Number(data[j]["fail"])/totle)*100);
-            errorrate.push((Number(data[j]["error"])/totle)*100)
+            rows.push([data[j]["startTime"], 1,
+                (Number(data[j]["success"])/totle)*100,
+                (Number(data[j]["fail"])/totle)*100,
+                (Number(data[j]["error"])/totle)*100]);
+        }
+        return rows;
+    }
+    function drawTrend() {
+        let trend = trendData();
+        let labels = [];
+        let successrate = [];
+        let failrate = [];
+        let errorrate = [];
+        for (var j = 0 ; j < trend.length; j++){
+            labels.push(trend[j][0]);
+            successrate.push(trend[j][2]);
+            failrate.push(trend[j][3]);
+            errorrate.push(trend[j][4]);
+        }
+        if (typeof echarts === 'undefined') {
+            // 离线查看且没有本地的echarts
+            return;
         }
-        console.log(successrate, failrate, errorrate)
         let myChartline = echarts.init(document.getElementById('chartline'));
         // 绘制图表
         let optionline = {
             title: {
-                text: '近十次测试结果',
+                text: '测试结果走势',
                 left: 'center',
                 top: 20,
                 textStyle: {
@@ -417,7 +872,7 @@ class Template_mixin(object):
             xAxis: [
                 {
                     type: 'category',
-                    data: ['1','2','3','4','5','6','7','8','9','10'],
+                    data: labels,
                     axisPointer: {
                         type: 'shadow'
                     }
@@ -431,7 +886,7 @@ class Template_mixin(object):
                     max: 100,
                     interval: 20,
                     axisLabel: {
-                        formatter: '{value} %%'
+                        formatter: '{value} %'
                     }
                 },
             ],
@@ -461,15 +916,101 @@ class Template_mixin(object):
     }
     function changeResult(obj) {
         var objSelectet = document.getElementById("testTime");
-        console.log(data[objSelectet.value])
         document.getElementById("title").innerText=data[objSelectet.value]["title"];
-        document.getElementsByClassName("attribute")[0].innerHTML='<strong>开始时间：</strong>'+data[objSelectet.value]["startTime"];
-        document.getElementsByClassName("attribute")[1].innerHTML='<strong>运行时长：</strong>'+data[objSelectet.value]["duration"];
-        document.getElementsByClassName("attribute")[2].innerHTML='<strong>状态：</strong>'+data[objSelectet.value]["status"];
-         document.getElementById("btn-group").innerHTML=data[objSelectet.value]["data"];
+        document.getElementsByClassName("attribute")[0].innerHTML='<strong>开始时间：</strong>'+html_escape(data[objSelectet.value]["startTime"]);
+        document.getElementsByClassName("attribute")[1].innerHTML='<strong>运行时长：</strong>'+html_escape(data[objSelectet.value]["duration"]);
+        document.getElementsByClassName("attribute")[2].innerHTML='<strong>状态：</strong>'+html_escape(data[objSelectet.value]["status"]);
+         if (data[objSelectet.value]["classes"] !== undefined) {
+             document.getElementById("btn-group").innerHTML=renderRun(data[objSelectet.value]);
+         } else if (data[objSelectet.value]["data"] !== undefined) {
+             // 旧版本保存的是渲染好的报告
+             document.getElementById("btn-group").innerHTML=data[objSelectet.value]["data"];
+         } else {
+             document.getElementById("btn-group").innerHTML='<p style="color:#999">该次测试未保存详细结果</p>';
+         }
          this.changChart(data[objSelectet.value]["success"],data[objSelectet.value]["fail"],data[objSelectet.value]["error"])
     }
+    /* 根据历史记录里的用例结果生成结果表格，只在切换到该次测试时渲染 */
+    function renderRun(run) {
+        var statusName = ['通过', '失败', '错误', '未执行'];
+        var caseStyle = ['passCase', 'failCase', 'errorCase', 'notrunCase'];
+        var tidPrefix = ['p', 'f', 'f', 'n'];
+        var rows = [];
+        var total = [0, 0, 0, 0];
+        var duration = 0;
+        for (var c = 0; c < run["classes"].length; c++) {
+            var cls = run["classes"][c];
+            var counts = [0, 0, 0, 0];
+            for (var k = 0; k < cls["tests"].length; k++) {
+                counts[cls["tests"][k]["status"]]++;
+            }
+            for (var k = 0; k < 4; k++) {
+                total[k] += counts[k];
+            }
+            var count = cls["tests"].length;
+            var clsStyle = counts[2] > 0 ? 'errorClass' : (counts[1] > 0 ? 'failClass' : 'passClass');
+            var clsDuration = Number(cls["duration"]) || 0;
+            if (cls["duration"] === undefined) {
+                clsDuration = 0;
+                for (var k = 0; k < count; k++) {
+                    clsDuration += Number(cls["tests"][k]["duration"]) || 0;
+                }
+            }
+            duration += clsDuration;
+            rows.push("<tr class='" + clsStyle + "' data-duration='" + clsDuration + "'><td>" + html_escape(cls["desc"]) + "</td><td>" + count +
+                "</td><td>" + counts[0] + "</td><td>" + counts[1] + "</td><td>" + counts[2] +
+                "</td><td><a href=\"javascript:showClassDetail('c" + (c+1) + "'," + count + ")\">详情</a></td><td>" +
+                clsDuration.toFixed(3) + "s</td><td>&nbsp;</td></tr>");
+            for (var k = 0; k < count; k++) {
+                var test = cls["tests"][k];
+                var tid = tidPrefix[test["status"]] + 't' + (c+1) + '.' + (k+1);
+                var detail = '';
+                var attempts = test["attempts"] || [];
+                for (var a = 0; a < attempts.length; a++) {
+                    detail += '第' + (a + 1) + '次执行: ' + statusName[attempts[a]["status"]] + ' ' +
+                        (Number(attempts[a]["duration"]) || 0).toFixed(3) + 's<br/>';
+                }
+                if (test["excerpt"] !== undefined) {
+                    detail += '<pre>' + html_escape(test["excerpt"]) + '</pre>';
+                }
+                if (test["log"] !== undefined) {
+                    detail += ' <a href="' + html_escape(test["log"]) + '" target="_blank">完整日志</a>';
+                }
+                var fixtures = [];
+                for (var name in test["fixtures"] || {}) {
+                    fixtures.push(html_escape(name) + ' ' + Number(test["fixtures"][name]).toFixed(3) + 's');
+                }
+                var hidden = test["status"] === 0 || test["status"] === 3;
+                rows.push("<tr id='" + tid + "' class='" + (hidden ? 'hiddenRow' : 'none') + "' data-duration='" + (Number(test["duration"]) || 0) + "'>" +
+                    "<td class='" + caseStyle[test["status"]] + "'><div class='testcase'>" + html_escape(test["desc"]) + "</div></td>" +
+                    "<td colspan='5' align='center'><a class='popup_link' href=\"javascript:showTestDetail('div_" + tid + "')\">" +
+                    statusName[test["status"]] + (attempts.length ? '(重试' + attempts.length + '次)' : '') +
+                    "</a><div id='div_" + tid + "' class='popup_window'>" + (detail || '无输出') + "</div></td>" +
+                    "<td title='" + fixtures.join(', ') + "'>" + (Number(test["duration"]) || 0).toFixed(3) + "s</td><td>&nbsp;</td></tr>");
+            }
+        }
+        var count = total[0] + total[1] + total[2];
+        var passrate = count ? (total[0] / count * 100).toFixed(2) : '0.00';
+        count += total[3];
+        return "<div class='btn-group btn-group-sm'>" +
+            "<a class='btn btn-primary' onclick='javascript:showCase(0)'>概要{ " + passrate + "% }</a>" +
+            "<a class='btn btn-warning' onclick='javascript:showCase(4)'>错误{ " + total[2] + " }</a>" +
+            "<a class='btn btn-danger' onclick='javascript:showCase(1)'>失败{ " + total[1] + " }</a>" +
+            "<a class='btn btn-success' onclick='javascript:showCase(2)'>通过{ " + total[0] + " }</a>" +
+            "<a class='btn btn-info' onclick='javascript:showCase(3)'>所有{ " + count + " }</a>" +
+            (total[3] ? "<a class='btn btn-default' onclick='javascript:showCase(5)'>未执行{ " + total[3] + " }</a>" : "") +
+            "</div><p></p>" +
+            "<table id='result_table' class='table table-bordered'><tr id='header_row'><td>测试套件/测试用例</td>" +
+            "<td>总数</td><td>通过</td><td>失败</td><td>错误</td><th>视图</th>" +
+            "<th><a href='javascript:sortByDuration()'>耗时</a></th><th>错误截图</th></tr>" +
+            rows.join('') +
+            "<tr id='total_row'><td>总计</td><td>" + count + "</td><td>" + total[0] + "</td><td>" + total[1] +
+            "</td><td>" + total[2] + "</td><td>&nbsp;</td><td>" + duration.toFixed(3) + "s</td><th>&nbsp;</th></tr></table>";
+    }
     function changChart(success, fail, error) {
+        if (typeof echarts === 'undefined') {
+            return;
+        }
         var myChart = echarts.init(document.getElementById('chart'));
         // 指定图表的配置项和数据
         var option = {
@@ -479,7 +1020,7 @@ class Template_mixin(object):
             },
             tooltip : {
                 trigger: 'item',
-                formatter: "{a} <br/>{b} : {c} ({d}%%)"
+                formatter: "{a} <br/>{b} : {c} ({d}%)"
             },
             color: ['#95b75d', 'grey', '#b64645'],
             legend: {
@@ -491,8 +1032,8 @@ class Template_mixin(object):
                 {
                     name: '测试执行情况',
                     type: 'pie',
-                    radius : '60%%',
-                    center: ['50%%', '60%%'],
+                    radius : '60%',
+                    center: ['50%', '60%'],
                     data:[
                         {value:success, name:'通过'},
                         {value:fail, name:'失败'},
@@ -525,63 +1066,58 @@ class Template_mixin(object):
         d.close();
     }
     */
-    --></script>
+"""
+
+    SCRIPT_TAG_TMPL = """<script language="javascript" type="text/javascript"><!--%(script)s    --></script>"""
 
-    <div id="div_base">
-        %(heading)s
-        %(report)s
-        %(ending)s
-        %(chart_script)s
-    </div>
-</body>
-</html>
-"""  # variables: (title, generator, stylesheet, heading, report, ending, chart_script)
 
     ECHARTS_SCRIPT = """
     <script type="text/javascript">
-        // 基于准备好的dom，初始化echarts实例
-        var myChart = echarts.init(document.getElementById('chart'));
+        if (typeof echarts !== 'undefined') {
+            // 基于准备好的dom，初始化echarts实例
+            var myChart = echarts.init(document.getElementById('chart'));
 
-        // 指定图表的配置项和数据
-        var option = {
-            title : {
-                text: '测试执行情况',
-                x:'center'
-            },
-            tooltip : {
-                trigger: 'item',
-                formatter: "{a} <br/>{b} : {c} ({d}%%)"
-            },
-            color: ['#95b75d', 'grey', '#b64645'],
-            legend: {
-                orient: 'vertical',
-                left: 'left',
-                data: ['通过','失败','错误']
-            },
-            series : [
-                {
-                    name: '测试执行情况',
-                    type: 'pie',
-                    radius : '60%%',
-                    center: ['50%%', '60%%'],
-                    data:[
-                        {value:%(Pass)s, name:'通过'},
-                        {value:%(fail)s, name:'失败'},
-                        {value:%(error)s, name:'错误'}
-                    ],
-                    itemStyle: {
-                        emphasis: {
-                            shadowBlur: 10,
-                            shadowOffsetX: 0,
-                            shadowColor: 'rgba(0, 0, 0, 0.5)'
+            // 指定图表的配置项和数据
+            var option = {
+                title : {
+                    text: '测试执行情况',
+                    x:'center'
+                },
+                tooltip : {
+                    trigger: 'item',
+                    formatter: "{a} <br/>{b} : {c} ({d}%%)"
+                },
+                color: ['#95b75d', 'grey', '#b64645'],
+                legend: {
+                    orient: 'vertical',
+                    left: 'left',
+                    data: ['通过','失败','错误']
+                },
+                series : [
+                    {
+                        name: '测试执行情况',
+                        type: 'pie',
+                        radius : '60%%',
+                        center: ['50%%', '60%%'],
+                        data:[
+                            {value:%(Pass)s, name:'通过'},
+                            {value:%(fail)s, name:'失败'},
+                            {value:%(error)s, name:'错误'}
+                        ],
+                        itemStyle: {
+                            emphasis: {
+                                shadowBlur: 10,
+                                shadowOffsetX: 0,
+                                shadowColor: 'rgba(0, 0, 0, 0.5)'
+                            }
                         }
                     }
-                }
-            ]
-        };
+                ]
+            };
 
-        // 使用刚指定的配置项和数据显示图表。
-        myChart.setOption(option);
+            // 使用刚指定的配置项和数据显示图表。
+            myChart.setOption(option);
+        }
     </script>
     """  # variables: (Pass, fail, error)
 
@@ -706,6 +1242,7 @@ class Template_mixin(object):
     .passCase   { color: #6c6; }
     .failCase   { color: #FF6600; font-weight: bold; }
     .errorCase  { color: #c00; font-weight: bold; }
+    .notrunCase { color: gray; }
     .hiddenRow  { display: none; }
     .testcase   { margin-left: 2em; }
 
@@ -741,8 +1278,12 @@ class Template_mixin(object):
     <select name = "testTime" id = "testTime" style="height: 30px;height: 30px; width:250px;margin: 5px;margin-left: 0px" onchange="changeResult(this)">
         <!--<option value = "">请选择</option>-->
     </select>
-    <p style="color:#999">*注<strong>: </strong>只保留最近十次的测试记录</p>
-"""  # variables: (title, parameters, description)
+    <select name = "trendScale" id = "trendScale" style="height: 30px; width:100px;margin: 5px" onchange="drawTrend()">
+        <option value = "daily">走势按天</option>
+        <option value = "weekly">走势按周</option>
+    </select>
+    <p style="color:#999">*注<strong>: </strong>只显示最近%(history_size)s次的测试记录</p>
+"""  # variables: (title, parameters, description, history_size)
 
     HEADING_ATTRIBUTE_TMPL = """<p class='attribute'><strong>%(name)s:</strong> %(value)s</p>
 """  # variables: (name, value)
@@ -758,7 +1299,7 @@ class Template_mixin(object):
         <a class="btn btn-warning" onclick='javascript:showCase(4)'>错误{ %(error)s }</a>
         <a class="btn btn-danger" onclick='javascript:showCase(1)'>失败{ %(fail)s }</a>
         <a class="btn btn-success" onclick='javascript:showCase(2)'>通过{ %(Pass)s }</a>
-        <a class="btn btn-info" onclick='javascript:showCase(3)'>所有{ %(count)s }</a>
+        <a class="btn btn-info" onclick='javascript:showCase(3)'>所有{ %(count)s }</a>%(notrun_button)s
     </div>
     <p></p>
     <table id='result_table' class="table table-bordered">
@@ -770,6 +1311,7 @@ class Template_mixin(object):
             <col align='right' />
             <col align='right' />
             <col align='right' />
+            <col align='right' />
         </colgroup>
         <tr id='header_row'>
             <td>测试套件/测试用例</td>
@@ -778,6 +1320,7 @@ class Template_mixin(object):
             <td>失败</td>
             <td>错误</td>
             <th>视图</th>
+            <th><a href='javascript:sortByDuration()'>耗时</a></th>
             <th>错误截图</th>
         </tr>
         %(test_list)s
@@ -788,26 +1331,31 @@ class Template_mixin(object):
             <td>%(fail)s</td>
             <td>%(error)s</td>
             <td>&nbsp;</td>
+            <td>%(duration)s</td>
             <th>&nbsp;</th>
         </tr>
     </table>
     </div>
-"""  # variables: (test_list, count, Pass, fail, error)
+"""  # variables: (test_list, count, Pass, fail, error, duration, notrun_button)
+
+    NOTRUN_BUTTON_TMPL = u"""
+        <a class="btn btn-default" onclick='javascript:showCase(5)'>未执行{ %(notrun)s }</a>"""  # variables: (notrun)
 
     REPORT_CLASS_TMPL = u"""
-    <tr class='%(style)s'>
+    <tr class='%(style)s' data-duration='%(seconds)s'>
         <td>%(desc)s</td>
         <td>%(count)s</td>
         <td>%(Pass)s</td>
         <td>%(fail)s</td>
         <td>%(error)s</td>
         <td><a href="javascript:showClassDetail('%(cid)s',%(count)s)">详情</a></td>
+        <td title='%(fixtures)s'>%(duration)s</td>
         <td>&nbsp;</td>
     </tr>
-"""  # variables: (style, desc, count, Pass, fail, error, cid)
+"""  # variables: (style, desc, count, Pass, fail, error, cid, seconds, duration, fixtures)
 
     REPORT_TEST_WITH_OUTPUT_TMPL = r"""
-<tr id='%(tid)s' class='%(Class)s'>
+<tr id='%(tid)s' class='%(Class)s' data-duration='%(seconds)s'>
     <td class='%(style)s'><div class='testcase'>%(desc)s</div></td>
     <td colspan='5' align='center'>
 
@@ -825,20 +1373,32 @@ class Template_mixin(object):
     <!--css div popup end-->
 
     </td>
+    <td title='%(fixtures)s'>%(duration)s</td>
     <td>%(img)s</td>
 </tr>
-"""  # variables: (tid, Class, style, desc, status)
+"""  # variables: (tid, Class, style, desc, status, seconds, duration, fixtures)
 
     REPORT_TEST_NO_OUTPUT_TMPL = r"""
-<tr id='%(tid)s' class='%(Class)s'>
+<tr id='%(tid)s' class='%(Class)s' data-duration='%(seconds)s'>
     <td class='%(style)s'><div class='testcase'>%(desc)s</div></td>
     <td colspan='5' align='center'>%(status)s</td>
+    <td title='%(fixtures)s'>%(duration)s</td>
     <td>%(img)s</td>
 </tr>
-"""  # variables: (tid, Class, style, desc, status)
+"""  # variables: (tid, Class, style, desc, status, seconds, duration, fixtures)
 
     REPORT_TEST_OUTPUT_TMPL = r"""%(id)s: %(output)s"""  # variables: (id, output)
 
+    RETRY_ATTEMPT_TMPL = u"""======== 第%(attempt)s次执行: %(status)s (%(duration)s) ========
+%(output)s
+"""  # variables: (attempt, status, duration, output)
+
+    # an output moved to a chunk file by compress, loaded by showTestDetail
+    CHUNK_TMPL = u"""<span data-chunk=%(url)s data-key=%(key)s>加载中...</span>"""  # variables: (url, key)
+
+    OUTPUT_LOG_TMPL = u"""
+<a href=%(href)s target="_blank">查看完整日志</a>"""  # variables: (href)
+
     IMG_TMPL = r"""
         <a href="#"  onclick="show_img(this)">显示截图</a>
     <div align="center" class="screenshots"  style="display:none;z-index:2000">
@@ -848,6 +1408,270 @@ class Template_mixin(object):
     </div>
     """
 
+    IMG_INLINE_TMPL = r""" <img src="data:%(mime)s;base64,%(img)s" style="display: %(display)s;" class="img"/>
+"""  # variables: (img, display, mime)
+
+    IMG_FILE_TMPL = r""" <img loading="lazy" src="%(src)s" style="display: %(display)s;" class="img"/>
+"""  # variables: (src, display)
+
+    # ------------------------------------------------------------------------
+    # Slowest tests
+    #
+
+    SLOWEST_TMPL = u"""
+    <div id='slowest'>
+    <h4>最慢的测试用例</h4>
+    <table class="table table-bordered">
+        <tr><td>测试用例</td><td>耗时</td><td>setUp/tearDown</td></tr>
+        %(tests)s
+    </table>
+    <h4>最慢的测试类/模块</h4>
+    <table class="table table-bordered">
+        <tr><td>测试类/模块</td><td>耗时</td><td>夹具耗时</td></tr>
+        %(classes)s
+    </table>
+    </div>
+"""  # variables: (tests, classes)
+
+    SLOWEST_ROW_TMPL = u"""
+        <tr><td>%(desc)s</td><td>%(duration)s</td><td>%(fixtures)s</td></tr>
+"""  # variables: (desc, duration, fixtures)
+
+    # ------------------------------------------------------------------------
+    # Virtual report
+    #
+    # Used with report_mode='virtual': the results are embedded as compact
+    # JSON and only the rows scrolled into view are put in the DOM. Each
+    # class is [description, passed, failed, errors, duration, not run] and each test
+    # is [class index, description, status, output, screenshots, log, duration].
+
+    VIRTUAL_REPORT_TMPL = r"""
+    <div id="btn-group">
+    <div class="btn-group btn-group-sm">
+        <a class="btn btn-primary" onclick='javascript:showCase(0)'>概要{ %(passrate)s }</a>
+        <a class="btn btn-warning" onclick='javascript:showCase(4)'>错误{ %(error)s }</a>
+        <a class="btn btn-danger" onclick='javascript:showCase(1)'>失败{ %(fail)s }</a>
+        <a class="btn btn-success" onclick='javascript:showCase(2)'>通过{ %(Pass)s }</a>
+        <a class="btn btn-info" onclick='javascript:showCase(3)'>所有{ %(count)s }</a>%(notrun_button)s
+    </div>
+    <p></p>
+    <style type="text/css">
+        .vt-row     { display: flex; height: 28px; line-height: 28px; border-bottom: 1px solid #ddd; white-space: nowrap; overflow: hidden; }
+        .vt-desc    { flex: 1; overflow: hidden; text-overflow: ellipsis; padding-left: 4px; }
+        .vt-num     { width: 60px; text-align: right; padding-right: 8px; }
+        .vt-view    { width: 120px; text-align: center; }
+        .vt-time    { width: 90px; text-align: right; padding-right: 8px; }
+        .vt-status  { width: 240px; text-align: center; }
+        #vt_header  { font-weight: bold; color: #303641; background-color: #ebebeb; }
+        #vt_total   { font-weight: bold; }
+        #vt_viewport { position: relative; height: 600px; overflow-y: auto; }
+        #vt_rows    { position: absolute; left: 0; right: 0; }
+        #vt_detail  { border: 1px solid #ddd; margin-top: 1ex; }
+        #vt_detail img { max-width: 100%%; display: block; margin-top: 1ex; }
+    </style>
+    <div id="vt_header" class="vt-row">
+        <span class="vt-desc">测试套件/测试用例</span><span class="vt-num">总数</span><span class="vt-num">通过</span>
+        <span class="vt-num">失败</span><span class="vt-num">错误</span><span class="vt-view">视图</span>
+        <span class="vt-time"><a href="javascript:sortByDuration()">耗时</a></span>
+    </div>
+    <div id="vt_viewport">
+        <div id="vt_spacer"></div>
+        <div id="vt_rows"></div>
+    </div>
+    <div id="vt_total" class="vt-row">
+        <span class="vt-desc">总计</span><span class="vt-num">%(count)s</span><span class="vt-num">%(Pass)s</span>
+        <span class="vt-num">%(fail)s</span><span class="vt-num">%(error)s</span><span class="vt-view">&nbsp;</span>
+        <span class="vt-time">%(duration)s</span>
+    </div>
+    <div id="vt_detail" class="popup_window"></div>
+    </div>
+    <script type="text/javascript">
+    var results = {"classes": %(classes)s, "tests": [
+%(test_list)s]};
+    (function () {
+        var ROW_HEIGHT = 28;
+        var OVERSCAN = 10;
+        var STATUS = ['通过', '失败', '错误', '未执行'];
+        var CASE_STYLE = ['passCase', 'failCase', 'errorCase', 'notrunCase'];
+        var CLASS_STYLE = ['passClass', 'failClass', 'errorClass'];
+        var LEVEL_STATUS = {0: [], 1: [1], 2: [0], 3: [0, 1, 2, 3], 4: [2], 5: [3]};
+        var classes = results["classes"];
+        var tests = results["tests"];
+        // 按类、按状态建好索引，筛选时只访问要显示的用例
+        var byStatus = [];
+        var classRange = [];
+        for (var c = 0; c < classes.length; c++) {
+            byStatus.push([[], [], [], []]);
+            classRange.push([tests.length, 0]);
+        }
+        for (var i = 0; i < tests.length; i++) {
+            var cls = tests[i][0];
+            byStatus[cls][tests[i][2]].push(i);
+            classRange[cls][0] = Math.min(classRange[cls][0], i);
+            classRange[cls][1] = i + 1;
+        }
+        var statuses = [1, 2];  // 初始显示失败和错误
+        var classOpen = {};
+        var order = null;       // 按耗时排序后的类顺序和各类的用例顺序
+        var durationDesc = false;
+        var visible = [];       // 可见行：类为 -1-类下标，用例为用例下标
+        var viewport = document.getElementById('vt_viewport');
+        var spacer = document.getElementById('vt_spacer');
+        var rowsDiv = document.getElementById('vt_rows');
+        var pending = false;
+
+        function classTests(c) {
+            var shown = classOpen[c] === undefined ? statuses : (classOpen[c] ? [0, 1, 2, 3] : []);
+            if (order) {
+                var sorted = [];
+                for (var k = 0; k < order.tests[c].length; k++) {
+                    if (shown.indexOf(tests[order.tests[c][k]][2]) >= 0) {
+                        sorted.push(order.tests[c][k]);
+                    }
+                }
+                return sorted;
+            }
+            if (shown.length === 4) {
+                var all = [];
+                for (var i = classRange[c][0]; i < classRange[c][1]; i++) {
+                    all.push(i);
+                }
+                return all;
+            }
+            var ids = [];
+            for (var k = 0; k < shown.length; k++) {
+                ids = ids.concat(byStatus[c][shown[k]]);
+            }
+            return shown.length > 1 ? ids.sort(function (a, b) { return a - b; }) : ids;
+        }
+        function rebuild() {
+            visible = [];
+            for (var j = 0; j < classes.length; j++) {
+                var c = order ? order.classes[j] : j;
+                visible.push(-1 - c);
+                // 逐个追加到同一个数组，concat每个类都会复制一遍visible
+                var ids = classTests(c);
+                for (var k = 0; k < ids.length; k++) {
+                    visible.push(ids[k]);
+                }
+            }
+            spacer.style.height = (visible.length * ROW_HEIGHT) + 'px';
+            render();
+        }
+        function rowHtml(r) {
+            if (r < 0) {
+                var c = -1 - r;
+                var cls = classes[c];
+                var count = cls[1] + cls[2] + cls[3] + cls[5];
+                var style = CLASS_STYLE[cls[3] > 0 ? 2 : (cls[2] > 0 ? 1 : 0)];
+                return "<div class='vt-row " + style + "'><span class='vt-desc'>" + html_escape(cls[0]) +
+                    "</span><span class='vt-num'>" + count + "</span><span class='vt-num'>" + cls[1] +
+                    "</span><span class='vt-num'>" + cls[2] + "</span><span class='vt-num'>" + cls[3] +
+                    "</span><span class='vt-view'><a href=\"javascript:showClassDetail('c" + (c + 1) + "'," + count +
+                    ")\">详情</a></span><span class='vt-time'>" + seconds(cls[4]) + "</span></div>";
+            }
+            var test = tests[r];
+            var shots = test[4].length ? ' (截图 ' + test[4].length + ')' : '';
+            return "<div class='vt-row'><span class='vt-desc " + CASE_STYLE[test[2]] + "'><span class='testcase'>" +
+                html_escape(test[1]) + "</span></span><span class='vt-status'><a class='popup_link' href='javascript:vtDetail(" +
+                r + ")'>" + STATUS[test[2]] + shots + "</a></span><span class='vt-view'>&nbsp;</span><span class='vt-time'>" +
+                seconds(test[6]) + "</span></div>";
+        }
+        function seconds(duration) {
+            return duration === null ? '-' : duration.toFixed(3) + 's';
+        }
+        function render() {
+            pending = false;
+            var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            var last = Math.min(visible.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+            var html = [];
+            for (var r = first; r < last; r++) {
+                html.push(rowHtml(visible[r]));
+            }
+            rowsDiv.style.top = (first * ROW_HEIGHT) + 'px';
+            rowsDiv.innerHTML = html.join('');
+        }
+        viewport.onscroll = function () {
+            if (!pending) {
+                pending = true;
+                window.requestAnimationFrame(render);
+            }
+        };
+
+        // 历史结果切换后页面上是普通表格，此时仍用原来的函数
+        var showCaseTable = window.showCase;
+        var showClassDetailTable = window.showClassDetail;
+        var sortByDurationTable = window.sortByDuration;
+        window.showCase = function (level) {
+            if (!document.getElementById('vt_viewport')) {
+                return showCaseTable(level);
+            }
+            statuses = LEVEL_STATUS[level];
+            classOpen = {};
+            rebuild();
+        };
+        window.showClassDetail = function (cid, count) {
+            if (!document.getElementById('vt_viewport')) {
+                return showClassDetailTable(cid, count);
+            }
+            var c = parseInt(cid.substr(1), 10) - 1;
+            classOpen[c] = classTests(c).length < classRange[c][1] - classRange[c][0];
+            rebuild();
+        };
+        window.sortByDuration = function () {
+            if (!document.getElementById('vt_viewport')) {
+                return sortByDurationTable();
+            }
+            durationDesc = !durationDesc;
+            var sign = durationDesc ? -1 : 1;
+            order = {classes: [], tests: []};
+            for (var c = 0; c < classes.length; c++) {
+                order.classes.push(c);
+                var ids = [];
+                for (var i = classRange[c][0]; i < classRange[c][1]; i++) {
+                    ids.push(i);
+                }
+                ids.sort(function (a, b) { return sign * ((tests[a][6] || 0) - (tests[b][6] || 0)); });
+                order.tests.push(ids);
+            }
+            order.classes.sort(function (a, b) { return sign * ((classes[a][4] || 0) - (classes[b][4] || 0)); });
+            rebuild();
+        };
+        window.vtDetail = function (i) {
+            var test = tests[i];
+            if (test[3] !== null && typeof test[3] === 'object') {
+                // 压缩模式: [分块文件, key]
+                var ref = test[3];
+                loadChunk(ref[0]).then(function (chunk) {
+                    if (test[3] === ref) {
+                        test[3] = chunk[ref[1]];
+                    }
+                    window.vtDetail(i);
+                }, function () {
+                    var detail = document.getElementById('vt_detail');
+                    detail.innerHTML = '<pre>加载失败: ' + html_escape(ref[0]) + '</pre>';
+                    detail.style.display = 'block';
+                });
+                return;
+            }
+            var html = ["<div style='text-align: right; color:red;cursor:pointer'><a onclick=\"document.getElementById('vt_detail').style.display = 'none'\">[x]</a></div>"];
+            html.push('<strong>' + html_escape(test[1]) + '</strong>');
+            html.push('<pre>' + html_escape(test[3]) + '</pre>');
+            if (test[5]) {
+                html.push("<a href='" + html_escape(test[5]) + "' target='_blank'>查看完整日志</a>");
+            }
+            for (var k = 0; k < test[4].length; k++) {
+                html.push("<img loading='lazy' src='" + html_escape(test[4][k]) + "'/>");
+            }
+            var detail = document.getElementById('vt_detail');
+            detail.innerHTML = html.join('');
+            detail.style.display = 'block';
+        };
+        rebuild();
+    })();
+    </script>
+"""  # variables: (classes, test_list, count, Pass, fail, error, passrate, duration, notrun_button)
+
     # ------------------------------------------------------------------------
     # ENDING
     #
@@ -855,190 +1679,2174 @@ class Template_mixin(object):
     ENDING_TMPL = """<div id='ending'>&nbsp;</div>"""
 
     # -------------------- The end of the Template class -------------------
-    def __getattribute__(self, item):
-        value = object.__getattribute__(self, item)
-        if PY3K:
-            return value
-        else:
-            if isinstance(value, str):
-                return value.decode("utf-8")
-            else:
-                return value
+    def _template(self, name):
+        """ The _Template of the *_TMPL attribute name, compiled once per distinct text """
+        return _Template.of(getattr(self, name))
 
 
-TestResult = unittest.TestResult
+def _unicode(s):
+    """ s as unicode, decoding utf-8 byte strings (python 2) """
+    if not PY3K and isinstance(s, str):
+        return s.decode('utf-8')
+    return s
 
 
-class _TestResult(TestResult):
-    # note: _TestResult is a pure representation of results.
-    # It lacks the output and reporting ability compares to unittest._TextTestResult.
+# <style> blocks of a stylesheet
+_STYLE_BLOCK = re.compile(r'<style[^>]*>(.*?)</style>', re.S)
 
-    def __init__(self, verbosity=1, retry=0, save_last_try=True):
-        TestResult.__init__(self)
-        self.stdout0 = None
-        self.stderr0 = None
-        self.success_count = 0
-        self.failure_count = 0
-        self.error_count = 0
-        self.verbosity = verbosity
 
-        # result is a list of result in 4 tuple
-        # (
-        #   result code (0: success; 1: fail; 2: error),
-        #   TestCase object,
-        #   Test output (byte string),
+def _read_asset(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _minify_css(css):
+    """ css without comments and needless whitespace """
+    css = re.sub(r'/\*.*?\*/', u'', css, flags=re.S)
+    css = re.sub(r'\s+', u' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return re.sub(r':\s+', u':', css).replace(u';}', u'}').strip()
+
+
+def _minify_js(js):
+    """ js without indentation, blank lines and // comment lines; statements keep their lines """
+    lines = (line.strip() for line in js.split(u'\n'))
+    return u'\n'.join(line for line in lines if line and not line.startswith(u'//'))
+
+
+# %(name)s and %% in a template
+_PLACEHOLDER = re.compile(r'%(?:\((\w+)\)s|%)')
+_text = str if PY3K else unicode  # noqa: F821
+
+
+class _Template(object):
+    """
+    A *_TMPL string compiled once. template % mapping renders it through a
+    function filling the values of its %(name)s placeholders into a copy of
+    the pre-split static text and joining it, faster than % on the row
+    templates; templates using other conversions are rendered with %
+    itself. Compiled templates are shared by all runners through of(), keyed
+    by their text, so overriding a *_TMPL attribute simply compiles the new
+    text; the CACHE_SIZE most recently compiled texts are kept.
+    """
+
+    CACHE_SIZE = 128
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def of(cls, text):
+        """ The compiled _Template of text """
+        with cls._cache_lock:
+            template = cls._cache.pop(text, None)
+            if template is None:
+                template = cls(text)
+                while len(cls._cache) >= cls.CACHE_SIZE:
+                    cls._cache.popitem(last=False)
+            cls._cache[text] = template
+            return template
+
+    def __init__(self, text):
+        self.text = _unicode(text)
+        self.render = self._compile(self.text)
+        self._halves = {}
+
+    def __mod__(self, mapping):
+        return self.render(mapping)
+
+    @staticmethod
+    def _compile(text):
+        pieces, names, piece, pos = [], [], [], 0
+        for match in _PLACEHOLDER.finditer(text):
+            piece.append(text[pos:match.start()])
+            pos = match.end()
+            if match.group(1) is None:
+                piece.append(u'%')
+            else:
+                pieces.append(u''.join(piece))
+                names.append(match.group(1))
+                piece = []
+        piece.append(text[pos:])
+        pieces.append(u''.join(piece))
+        # static pieces with a slot for each value in between
+        parts = [pieces[0]]
+        slots = []
+        for name, piece in zip(names, pieces[1:]):
+            slots.append((len(parts), name))
+            parts.extend((None, piece))
+
+        def render(m):
+            filled = parts[:]
+            for i, name in slots:
+                filled[i] = _text(m[name])
+            return u''.join(filled)
+
+        # anything but %(name)s and %% (e.g. %(count)d) is left to %
+        probe = dict((name, u'\x00%d\x00' % i) for i, name in enumerate(names))
+        try:
+            if render(probe) == text % probe:
+                return render
+        except (TypeError, ValueError, KeyError):
+            pass
+        return text.__mod__
+
+    def split(self, name):
+        """ The _Templates before and after %(name)s, or [self] without it """
+        if name not in self._halves:
+            halves = self.text.split(u'%%(%s)s' % name, 1)
+            self._halves[name] = len(halves) == 2 and [_Template(half) for half in halves] or [self]
+        return self._halves[name]
+
+
+TestResult = unittest.TestResult
+
+
+class _TestClassInfo(object):
+    """ Picklable stand-in for a TestCase class, grouped like the class itself in sortResult """
+    def __init__(self, module, name, doc=None):
+        self.__module__ = module
+        self.__name__ = name
+        self.__doc__ = doc
+
+    def __eq__(self, other):
+        return isinstance(other, _TestClassInfo) and \
+            (self.__module__, self.__name__) == (other.__module__, other.__name__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__module__, self.__name__))
+
+
+# one _TestClassInfo per class, shared by its tests; cleared for every run
+_CLASS_INFOS = {}
+
+
+def _class_info(module, name, doc):
+    key = (module, name, doc)
+    info = _CLASS_INFOS.get(key)
+    if info is None:
+        info = _CLASS_INFOS[key] = _TestClassInfo(module, name, doc)
+    return info
+
+
+class _TestInfo(object):
+    """
+    Compact, picklable snapshot of a finished TestCase: just what the report
+    needs. _TestResult keeps it in place of the TestCase from stopTest on, so
+    the TestCase and whatever hangs on it can be freed; it also carries the
+    results of pool workers across process boundaries.
+    """
+    __slots__ = ('test_id', 'test_str', '_testMethodDoc', 'imgs', 'duration', 'fixture_times', 'attempts',
+                 'output_log', 'test_class')
+
+    def __init__(self, test):
+        self.test_id = test.id()
+        self.test_str = str(test)
+        self._testMethodDoc = getattr(test, '_testMethodDoc', None)
+        # the same list, screenshots still being processed are stored into it
+        self.imgs = getattr(test, 'imgs', None) or []
+        self.duration = getattr(test, 'duration', None)
+        self.fixture_times = getattr(test, 'fixture_times', None) or {}
+        self.attempts = getattr(test, 'attempts', None) or []
+        self.output_log = getattr(test, 'output_log', None)
+        cls = test.__class__
+        self.test_class = _class_info(cls.__module__, cls.__name__, cls.__doc__)
+
+    def to_record(self):
+        """ The test as a JSON-serializable dict, see from_record """
+        cls = self.test_class
+        return dict(id=self.test_id, str=self.test_str, doc=self._testMethodDoc, imgs=self.imgs,
+                    duration=self.duration, fixtures=self.fixture_times, attempts=self.attempts,
+                    log=self.output_log, cls=[cls.__module__, cls.__name__, cls.__doc__])
+
+    @classmethod
+    def from_record(cls, record):
+        info = cls.__new__(cls)
+        info.test_id = record['id']
+        info.test_str = record.get('str') or record['id']
+        info._testMethodDoc = record.get('doc')
+        info.imgs = record.get('imgs') or []
+        info.duration = record.get('duration')
+        info.fixture_times = record.get('fixtures') or {}
+        info.attempts = record.get('attempts') or []
+        info.output_log = record.get('log')
+        info.test_class = _class_info(*record['cls'])
+        return info
+
+    def id(self):
+        return self.test_id
+
+    def __str__(self):
+        return self.test_str
+
+
+def _test_info(test):
+    """ test as a _TestInfo """
+    return test if isinstance(test, _TestInfo) else _TestInfo(test)
+
+
+# high resolution clock for test durations
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def _image_mime(img):
+    """ Guess the MIME type of a base64 image from its first bytes """
+    try:
+        data = base64.b64decode(img[:16])
+    except (TypeError, ValueError):
+        return 'image/png'
+    return 'image/' + _image_ext(data)[1:].replace('jpg', 'jpeg')
+
+
+def _image_ext(data):
+    """ Guess the file extension of an image from its leading bytes """
+    if data.startswith(b'\xff\xd8'):
+        return '.jpg'
+    if data.startswith(b'GIF8'):
+        return '.gif'
+    return '.png'
+
+
+def _iter_tests(test):
+    """ Yield the TestCases of a (possibly nested) suite in run order """
+    if isinstance(test, unittest.TestSuite):
+        for t in test:
+            for case in _iter_tests(t):
+                yield case
+    else:
+        yield test
+
+
+def _split_units(test):
+    """
+    Split a suite into work units, one TestSuite per TestCase class, so
+    setUpClass/tearDownClass run once per unit. Units keep loader order.
+    """
+    units = OrderedDict()
+    for case in _iter_tests(test):
+        units.setdefault(case.__class__, []).append(case)
+    return [unittest.TestSuite(cases) for cases in units.values()]
+
+
+def _class_key(cls):
+    """ Key of a TestCase class (or _TestClassInfo) in the fixture timings """
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+_MISSING = object()
+
+
+class _FixtureTimer(object):
+    """
+    Context manager timing the class and module fixtures of the tests in a
+    suite while it runs. setUpClass/tearDownClass and setUpModule/
+    tearDownModule are wrapped on enter and restored on exit; their
+    durations go to timings, keyed by _class_key() or module name:
+    {'module.Class': {'setUpClass': seconds, 'tearDownClass': seconds}}
+    """
+    CLASS_FIXTURES = ('setUpClass', 'tearDownClass')
+    MODULE_FIXTURES = ('setUpModule', 'tearDownModule')
+
+    def __init__(self, test, timings):
+        self.timings = timings
+        self.classes = []
+        self.modules = []
+        for case in _iter_tests(test):
+            cls = case.__class__
+            if isinstance(case, unittest.TestCase) and cls not in self.classes:
+                self.classes.append(cls)
+                module = sys.modules.get(cls.__module__)
+                if module is not None and module not in self.modules:
+                    self.modules.append(module)
+        self._patched = []
+
+    def __enter__(self):
+        # look every fixture up before patching any, so a class gets the
+        # fixture it inherits and not the wrapper of its base class
+        fixtures = []
+        for cls in self.classes:
+            for name in self.CLASS_FIXTURES:
+                fixture = self._lookup(cls, name)
+                if fixture is not None:
+                    fixtures.append((cls, name, fixture))
+        for cls, name, fixture in fixtures:
+            self._patch(cls, name, classmethod(self._timed_class_fixture(fixture, name)))
+        for module in self.modules:
+            for name in self.MODULE_FIXTURES:
+                fixture = getattr(module, name, None)
+                if fixture is not None:
+                    self._patch(module, name, self._timed(fixture, module.__name__, name))
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._patched:
+            owner, name, saved = self._patched.pop()
+            if saved is _MISSING:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, saved)
+
+    @staticmethod
+    def _lookup(cls, name):
+        """ The classmethod cls inherits as name, or None for unittest's no-op default """
+        for klass in cls.__mro__:
+            if klass is unittest.TestCase:
+                return None
+            fixture = vars(klass).get(name)
+            if fixture is not None:
+                return fixture if isinstance(fixture, classmethod) else None
+        return None
+
+    def _patch(self, owner, name, value):
+        self._patched.append((owner, name, vars(owner).get(name, _MISSING)))
+        setattr(owner, name, value)
+
+    def _timed_class_fixture(self, fixture, name):
+        timings = self.timings
+
+        def timed(cls):
+            # a subclass calling super().setUpClass() lands here too; its
+            # own wrapper finishes last and records the total
+            start = _timer()
+            try:
+                return fixture.__get__(None, cls)()
+            finally:
+                timings.setdefault(_class_key(cls), {})[name] = _timer() - start
+                if _tracer is not None:
+                    _tracer.complete(name, 'fixture', start, dict(cls=_class_key(cls)))
+        return timed
+
+    def _timed(self, func, key, name):
+        timings = self.timings
+
+        def timed(*args, **kwargs):
+            start = _timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.setdefault(key, {})[name] = _timer() - start
+                if _tracer is not None:
+                    _tracer.complete(name, 'fixture', start, dict(module=key))
+        return timed
+
+
+def _time_test_fixtures(test):
+    """ Wrap setUp/tearDown on the test instance to time them into test.fixture_times """
+    test.fixture_times = {}
+    if not isinstance(test, unittest.TestCase):
+        return
+    for name in ('setUp', 'tearDown'):
+        method = getattr(type(test), name)
+        if method != getattr(unittest.TestCase, name):
+            method = method.__get__(test, type(test))
+            setattr(test, name, _time_method(test.fixture_times, name, method))
+
+
+def _untime_test_fixtures(test):
+    """ Undo _time_test_fixtures, so no wrapper outlives the test run """
+    if isinstance(test, unittest.TestCase):
+        for name in ('setUp', 'tearDown'):
+            vars(test).pop(name, None)
+
+
+def _time_method(timings, name, method):
+    def timed(*args, **kwargs):
+        start = _timer()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings[name] = _timer() - start
+            if _tracer is not None:
+                _tracer.complete(name, 'fixture', start)
+    return timed
+
+
+def _history_stats(entries):
+    """
+    Summarize the history runs entries (oldest first) per test id as
+    (failed in its latest run, failure rate, mean duration). A test that
+    only passed on retry counts as failed.
+    """
+    runs = {}
+    for entry in entries:
+        for cls in entry.get('classes') or []:
+            for record in cls.get('tests', []):
+                if record.get('status') == 3:
+                    continue
+                failed = bool(record.get('status')) or \
+                    any(a.get('status') for a in record.get('attempts', []))
+                runs.setdefault(record.get('id'), []).append((failed, record.get('duration') or 0))
+    stats = {}
+    for tid, results in runs.items():
+        stats[tid] = (int(results[-1][0]),
+                      float(sum(failed for failed, duration in results)) / len(results),
+                      float(sum(duration for failed, duration in results)) / len(results))
+    return stats
+
+
+def _order_tests(test, stats, order, grouped=True):
+    """
+    Return the tests of test as one flat TestSuite ordered by their
+    _history_stats(): 'failed' puts the tests that failed last time, then
+    those that fail most often, first; 'slow' puts the longest first. The
+    tests of a class stay together, and with grouped so do the classes of
+    a module, so no fixture is set up twice. Ties keep loader order.
+    """
+    if order not in ('failed', 'slow'):
+        raise ValueError("order must be 'failed' or 'slow', not %r" % (order,))
+
+    def key(cases):
+        known = [stats.get(case.id(), (0, 0.0, 0.0)) for case in cases]
+        duration = sum(s[2] for s in known)
+        if order == 'slow':
+            return -duration
+        return -max(s[0] for s in known), -max(s[1] for s in known), -duration
+
+    groups = OrderedDict()
+    for case in _iter_tests(test):
+        cls = case.__class__
+        group = groups.setdefault(grouped and cls.__module__ or cls, OrderedDict())
+        group.setdefault(cls, []).append(case)
+    suite = unittest.TestSuite()
+    for classes in sorted(groups.values(), key=lambda g: key([c for cases in g.values() for c in cases])):
+        for cases in sorted(classes.values(), key=key):
+            suite.addTests(sorted(cases, key=lambda case: key([case])))
+    return suite
+
+
+def _parse_shard(shard):
+    """ (index, count) of a shard given as 'i/n' or (i, n), 1 <= i <= n """
+    try:
+        index, count = [int(v) for v in (shard.split('/') if isinstance(shard, str) else shard)]
+    except (TypeError, ValueError):
+        raise ValueError("shard must be 'i/n', not %r" % (shard,))
+    if not 1 <= index <= count:
+        raise ValueError("shard must be 'i/n' with 1 <= i <= n, not %r" % (shard,))
+    return index, count
+
+
+def _shard_tests(test, stats, index, count):
+    """
+    Return (the tests of shard index of count as a TestSuite, a digest of
+    the partition). Whole classes are dealt to the shard with the least
+    work so far, longest first, using the mean durations of _history_stats()
+    (tests without history count as the mean known test; with no stats at
+    all every test counts 1, so the partition follows the test ids alone).
+    Every shard computes the same partition as long as they see the same
+    tests and stats; the digest tells whether they did. Shards keep loader
+    order.
+    """
+    units = OrderedDict()
+    for case in _iter_tests(test):
+        units.setdefault(_class_key(case.__class__), []).append(case)
+    known = [stats[tid][2] for tid in stats]
+    default = sum(known) / len(known) if known else 1.0
+    weights = dict((key, sum(stats[case.id()][2] if case.id() in stats else default for case in cases))
+                   for key, cases in units.items())
+    loads = [0.0] * count
+    plan = {}
+    for key in sorted(units, key=lambda k: (-weights[k], k)):
+        shard = loads.index(min(loads))
+        loads[shard] += weights[key]
+        plan[key] = shard + 1
+    digest = hashlib.sha1(json.dumps(sorted((key, [case.id() for case in units[key]], plan[key])
+                                            for key in units)).encode('utf-8')).hexdigest()
+    suite = unittest.TestSuite()
+    for key, cases in units.items():
+        if plan[key] == index:
+            suite.addTests(cases)
+    return suite, digest
+
+
+class _StopSignal(object):
+    """
+    Shared by the results of one run, also across pool processes. Once
+    max_failures tests have failed or errored, or time_budget seconds have
+    passed, is_set() turns true and no further test is started; tests
+    already running finish normally.
+    """
+    def __init__(self, max_failures=None, time_budget=None):
+        self.max_failures = max_failures
+        self.deadline = None if time_budget is None else time.time() + time_budget
+        self.event = multiprocessing.Event()
+        self.failures = multiprocessing.Value('i', 0)
+
+    def failed(self):
+        with self.failures.get_lock():
+            self.failures.value += 1
+            if self.max_failures and self.failures.value >= self.max_failures:
+                self.event.set()
+
+    def set(self):
+        self.event.set()
+
+    def is_set(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.event.set()
+        return self.event.is_set()
+
+
+# the _StopSignal of the current run, if it has limits
+_stop_signal = None
+
+
+def _init_pool_process(stop_signal, profile=False):
+    """ Pool initializer: the signal can only reach a process when it starts """
+    global _stop_signal, _tracer
+    _stop_signal = stop_signal
+    # a forked process must not inherit the spans of its parent
+    _tracer = PhaseTracer(worker=True) if profile else None
+
+
+def _pool_process(conn, stop_signal, profile=False):
+    """ A process of the process executor: run the units sent on conn, answering each with its snapshot """
+    _init_pool_process(stop_signal, profile)
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+        if args is None:
+            return
+        conn.send(_run_unit(args))
+
+
+def _wait_ready(workers, timeout=1):
+    """ The (process, conn) workers with a reply waiting or a dead process """
+    if _wait_connections is None:
+        # python 2: poll
+        deadline = time.time() + timeout
+        while True:
+            ready = [w for w in workers if w[1].poll() or not w[0].is_alive()]
+            if ready or time.time() >= deadline:
+                return ready
+            time.sleep(0.01)
+    handles = _wait_connections([w[1] for w in workers] + [w[0].sentinel for w in workers], timeout)
+    return [w for w in workers if w[1] in handles or w[0].sentinel in handles]
+
+
+def _run_unit(args):
+    """ Pool worker: run one work unit and return its picklable snapshot """
+    global _screenshot_service
+    unit, result_kwargs, screenshot_args, time_fixtures = args
+    if screenshot_args and (_screenshot_service is None or _screenshot_service.pid != os.getpid()):
+        # a pool process takes its own screenshots, for all units it runs
+        _screenshot_service = ScreenshotService(*screenshot_args)
+    result = _TestResult(stop_signal=_stop_signal, **result_kwargs)
+    if time_fixtures:
+        with _FixtureTimer(unit, result.fixture_times):
+            unit(result)
+    else:
+        unit(result)
+    if _screenshot_service is not None:
+        _screenshot_service.drain()
+    if result.journal:
+        result.journal.close()
+    snapshot = result.snapshot()
+    if _tracer is not None and _tracer.worker:
+        snapshot['trace'] = _tracer.take()
+    return snapshot
+
+
+# ----------------------------------------------------------------------
+# Profiling
+
+
+class PhaseTracer(object):
+    """
+    Spans of a run for HTMLTestRunner(profile=...): the tests, their
+    fixtures, the result callbacks, the report stages and the history I/O.
+    save() writes them in the Chrome Trace Event format, for
+    chrome://tracing or Perfetto, and summary() totals them by name.
+    The tracer of a pool process (worker=True) hands its spans back with
+    the results of each unit.
+    """
+
+    def __init__(self, worker=False):
+        self.pid = os.getpid()
+        self.worker = worker
+        self.events = []
+        # timestamps are wall clock microseconds, so pool processes line up
+        self._offset = time.time() - _timer()
+
+    def complete(self, name, cat, start, args=None):
+        """ Record a span from start (a _timer() value) until now """
+        end = _timer()
+        event = dict(name=name, cat=cat, ph='X', ts=int((start + self._offset) * 1e6),
+                     dur=int((end - start) * 1e6), pid=os.getpid(), tid=threading.current_thread().ident)
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def take(self):
+        """ Return the spans recorded so far and forget them """
+        events, self.events = self.events, []
+        return events
+
+    def save(self, path):
+        metadata = [dict(name='process_name', ph='M', pid=self.pid, args=dict(name='HTMLTestRunner'))]
+        threads = {}
+        for thread in threading.enumerate():
+            threads[thread.ident] = thread.name
+        for pid, tid in sorted(set((event['pid'], event['tid']) for event in self.events)):
+            if pid != self.pid:
+                metadata.append(dict(name='process_name', ph='M', pid=pid, args=dict(name='worker %d' % pid)))
+            if pid == self.pid and tid in threads:
+                metadata.append(dict(name='thread_name', ph='M', pid=pid, tid=tid, args=dict(name=threads[tid])))
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=metadata + self.events, displayTimeUnit='ms'), f)
+
+    def summary(self):
+        """ Count, total, mean and max duration of the spans by name; tests are totalled as one row """
+        totals = OrderedDict()
+        for event in self.events:
+            key = (event['cat'] == 'test' and 'test' or event['name'], event['cat'])
+            total = totals.setdefault(key, [0, 0, 0])
+            total[0] += 1
+            total[1] += event['dur']
+            total[2] = max(total[2], event['dur'])
+        lines = ['%-36s %-8s %8s %10s %10s %10s' % ('span', 'cat', 'count', 'total(s)', 'mean(ms)', 'max(ms)')]
+        for (name, cat), (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append('%-36s %-8s %8d %10.3f %10.3f %10.3f' % (
+                name[:36], cat, count, total / 1e6, total / 1e3 / count, longest / 1e3))
+        return '\n'.join(lines) + '\n'
+
+
+class _Span(object):
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = _timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _tracer is not None:
+            _tracer.complete(self.name, self.cat, self.start, self.args)
+
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+# the PhaseTracer of the running HTMLTestRunner, if it profiles
+_tracer = None
+
+
+def _span(name, cat='report', **args):
+    """ Context manager recording a span of the run, when it is profiled """
+    if _tracer is None:
+        return _NO_SPAN
+    return _Span(name, cat, args)
+
+
+class _TestResult(TestResult):
+    # note: _TestResult is a pure representation of results.
+    # It lacks the output and reporting ability compares to unittest._TextTestResult.
+
+    def __init__(self, verbosity=1, redirect=True, output_limit=None, output_dir=None, stop_signal=None,
+                 journal=None, attempt=0, sinks=None):
+        # a _StopSignal shared with the other results of the run; set before
+        # TestResult.__init__ assigns shouldStop
+        self.stop_signal = stop_signal
+        self._should_stop = False
+        # failures and errors are derived from result, so each traceback is
+        # kept once; these hold the ones without a result entry, e.g. failed
+        # subtests
+        self._other_failures = []
+        self._other_errors = []
+        # (failures, errors) derived from them, until _count() or stopTest changes result
+        self._failed = None
+        TestResult.__init__(self)
+        self.stdout0 = None
+        self.stderr0 = None
+        self.success_count = 0
+        self.failure_count = 0
+        self.error_count = 0
+        self.notrun_count = 0
+        self.verbosity = verbosity
+
+        # result is a list of result in 4 tuple
+        # (
+        #   result code (0: success; 1: fail; 2: error; 3: not run),
+        #   TestCase object, replaced by its _TestInfo at stopTest,
+        #   Test output (byte string),
         #   stack trace,
         # )
         self.result = []
-        self.retry = retry
-        self.trys = 0
-        self.status = 0
-        self.save_last_try = save_last_try
-        self.outputBuffer = StringIO.StringIO()
+        # output past output_limit characters is truncated, or spilled to a
+        # log file in output_dir when that is set
+        self.outputBuffer = _OutputBuffer(output_limit, output_dir)
+        # redirect=False leaves sys.stdout/sys.stderr alone; the thread pool
+        # installs the redirectors once for all of its threads instead.
+        self.redirect = redirect
+        # guards the counters and the result list against concurrent updates
+        self._lock = threading.RLock()
+        # class and module fixture durations, filled in by _FixtureTimer
+        self.fixture_times = {}
+        # ids of the tests started, to find those a stopped run never ran
+        self.started = set()
+        # finished tests are appended to this ResultJournal file, marked
+        # with the retry round (attempt) they ran in
+        self.journal = journal and ResultJournal(journal)
+        self.attempt = attempt
+        # indexes in result of the entries of the running test, finished at stopTest
+        self._unfinished = []
+        # the ResultPipeline of the run, sent each finished test like the journal
+        self.sinks = sinks
+        # with retry, the runner's TestCases by id; those that pass are
+        # replaced by their _TestInfo at stopTest, so they can be freed
+        self.cases = None
+
+    @property
+    def shouldStop(self):
+        return self._should_stop or (self.stop_signal is not None and self.stop_signal.is_set())
+
+    @shouldStop.setter
+    def shouldStop(self, value):
+        # stop(), e.g. on Ctrl-C, stops the other workers of the run too
+        self._should_stop = value
+        if value and self.stop_signal is not None:
+            self.stop_signal.set()
+
+    @property
+    def failures(self):
+        return self._derive_failed()[0]
+
+    @failures.setter
+    def failures(self, value):
+        self._other_failures = list(value)
+        self._failed = None
+
+    @property
+    def errors(self):
+        return self._derive_failed()[1]
+
+    @errors.setter
+    def errors(self, value):
+        self._other_errors = list(value)
+        self._failed = None
+
+    def _derive_failed(self):
+        if self._failed is None:
+            failures, errors = [], []
+            for n, t, o, e in self.result:
+                if n == 1:
+                    failures.append((t, e))
+                elif n == 2:
+                    errors.append((t, e))
+            self._failed = (failures + self._other_failures, errors + self._other_errors)
+        return self._failed
+
+    def startTest(self, test):
+        test.imgs = []
+        test.duration = None
+        test.output_log = None
+        _time_test_fixtures(test)
+        self.started.add(test.id())
+        self._test_started = _timer()
+        TestResult.startTest(self, test)
+        # just one buffer for both stdout and stderr
+        self.outputBuffer.reset(test.id())
+        stdout_redirector.bind(self.outputBuffer)
+        stderr_redirector.bind(self.outputBuffer)
+        if self.redirect:
+            self.stdout0 = sys.stdout
+            self.stderr0 = sys.stderr
+            sys.stdout = stdout_redirector
+            sys.stderr = stderr_redirector
+
+    def complete_output(self):
+        """
+        Disconnect output redirection and return buffer.
+        Safe to call multiple times.
+        """
+        stdout_redirector.unbind()
+        stderr_redirector.unbind()
+        self.outputBuffer.close()
+        if self.stdout0:
+            sys.stdout = self.stdout0
+            sys.stderr = self.stderr0
+            self.stdout0 = None
+            self.stderr0 = None
+        return self.outputBuffer.getvalue()
+
+    def stopTest(self, test):
+        # Usually one of addSuccess, addError or addFailure would have been called.
+        # But there are some path in unittest that would bypass this.
+        # We must disconnect stdout in stopTest(), which is guaranteed to be called.
+        # The add* methods can run before tearDown, so the duration is final only here.
+        test.duration = _timer() - self._test_started
+        _untime_test_fixtures(test)
+        # failed tests are retried by HTMLTestRunner after the whole suite has run
+        self.complete_output()
+        info = None
+        if self.cases is not None and test.id() in self.cases and \
+                not any(self.result[index][0] for index in self._unfinished):
+            # passed or skipped: no retry needs the TestCase
+            info = self.cases[test.id()] = _TestInfo(test)
+        if self._unfinished:
+            info = info or _TestInfo(test)
+            with self._lock:
+                for index in self._unfinished:
+                    n, t, o, e = self.result[index]
+                    if t is test:
+                        # the TestCase, and whatever the test hangs on it, can go now
+                        self.result[index] = (n, info, o, e)
+                self._failed = None
+                entries = [self.result[index] for index in self._unfinished]
+                self._unfinished = []
+            for entry in entries:
+                self._finished(entry)
+        elif self.journal is not None:
+            # e.g. skipped, or failed only in subtests: it still ran
+            self.journal.write(dict(type='finished', id=test.id(), attempt=self.attempt, time=time.time()))
+        if _tracer is not None:
+            _tracer.complete(test.id(), 'test', self._test_started)
+
+    def _record(self, entry):
+        """ Add a result entry; a test's is finished at stopTest, when its duration is final """
+        with self._lock:
+            self.result.append(entry)
+            self._count(entry)
+            if isinstance(entry[1], unittest.TestCase):
+                self._unfinished.append(len(self.result) - 1)
+                return
+        # e.g. an _ErrorHolder for a failed setUpClass, never started
+        self._finished(entry)
+
+    def _finished(self, entry):
+        if self.journal is not None:
+            self.journal.write(_journal_record(entry, self.attempt))
+        if self.sinks is not None:
+            self.sinks.emit(entry, self.attempt)
+
+    def _stop_clock(self, test):
+        """ Record how long test has been running since startTest, and where its full output went """
+        if self.outputBuffer.log_path:
+            test.output_log = self.outputBuffer.log_path
+        if getattr(test, 'duration', None) is None:
+            try:
+                test.duration = _timer() - self._test_started
+            except AttributeError:
+                # e.g. an _ErrorHolder for a failed class fixture
+                pass
+
+    def snapshot(self):
+        """
+        Return the results as a picklable dict, with every TestCase replaced
+        by a _TestInfo. Used to send results back from a pool worker.
+        """
+        return dict(
+            result=[(n, _test_info(t), o, e) for n, t, o, e in self.result],
+            success_count=self.success_count,
+            failure_count=self.failure_count,
+            error_count=self.error_count,
+            testsRun=self.testsRun,
+            fixture_times=self.fixture_times,
+            started=list(self.started),
+            other_failures=self._other_failures,
+            other_errors=self._other_errors,
+        )
+
+    def merge(self, snapshot):
+        """ Fold a snapshot() from another _TestResult into this one """
+        with self._lock:
+            self.testsRun += snapshot['testsRun']
+            self.started.update(snapshot['started'])
+            for key, times in snapshot['fixture_times'].items():
+                self.fixture_times.setdefault(key, {}).update(times)
+            # e.g. failed subtests, which have no result entry
+            for n, key in ((1, 'other_failures'), (2, 'other_errors')):
+                for t, e in snapshot.get(key, ()):
+                    (self._other_failures if n == 1 else self._other_errors).append((t, e))
+                    if self.sinks is not None:
+                        self.sinks.emit((n, t, '', e), self.attempt)
+            self._failed = None
+            for entry in snapshot['result']:
+                self.result.append(entry)
+                self._count(entry)
+                if self.sinks is not None:
+                    self.sinks.emit(entry, self.attempt)
+
+    def _count(self, entry, sign=1):
+        """ Add (sign=1) or take back (sign=-1) a result entry in the counters """
+        self._failed = None
+        n = entry[0]
+        if n == 0:
+            self.success_count += sign
+        elif n == 1:
+            self.failure_count += sign
+        elif n == 2:
+            self.error_count += sign
+        else:
+            self.notrun_count += sign
+
+    def addSuccess(self, test):
+        start = _timer()
+        self._stop_clock(test)
+        TestResult.addSuccess(self, test)
+        output = self.complete_output()
+        self._record((0, test, output, ''))
+        if self.verbosity > 1:
+            sys.stderr.write('ok ')
+            sys.stderr.write(str(test))
+            sys.stderr.write('\n')
+        else:
+            sys.stderr.write('.')
+        if _tracer is not None:
+            _tracer.complete('addSuccess', 'result', start)
+
+    def addError(self, test, err):
+        start = _timer()
+        self._stop_clock(test)
+        # what TestResult.addError does, but the traceback is only kept in the entry
+        _exc_str = self._exc_info_to_string(err, test)
+        self._mirrorOutput = True
+        if self.failfast:
+            self.stop()
+        output = self.complete_output()
+        self._record((2, test, output, _exc_str))
+        if self.stop_signal is not None:
+            self.stop_signal.failed()
+        if getattr(test, "driver", ""):
+            capture_screenshot(test)
+        if self.verbosity > 1:
+            sys.stderr.write('E  ')
+            sys.stderr.write(str(test))
+            sys.stderr.write('\n')
+        else:
+            sys.stderr.write('E')
+        if _tracer is not None:
+            _tracer.complete('addError', 'result', start)
+
+    def addFailure(self, test, err):
+        start = _timer()
+        self._stop_clock(test)
+        _exc_str = self._exc_info_to_string(err, test)
+        self._mirrorOutput = True
+        if self.failfast:
+            self.stop()
+        output = self.complete_output()
+        self._record((1, test, output, _exc_str))
+        if self.stop_signal is not None:
+            self.stop_signal.failed()
+        if getattr(test, "driver", ""):
+            capture_screenshot(test)
+        if self.verbosity > 1:
+            sys.stderr.write('F  ')
+            sys.stderr.write(str(test))
+            sys.stderr.write('\n')
+        else:
+            sys.stderr.write('F')
+        if _tracer is not None:
+            _tracer.complete('addFailure', 'result', start)
+
+    def addSubTest(self, test, subtest, err):
+        # TestResult.addSubTest would append to the derived failures/errors
+        if err is not None:
+            if self.failfast:
+                self.stop()
+            n = 1 if issubclass(err[0], test.failureException) else 2
+            # a _TestInfo, so it can go back from a pool worker, filed under the test's class
+            info = _TestInfo(subtest)
+            cls = test.__class__
+            info.test_class = _class_info(cls.__module__, cls.__name__, cls.__doc__)
+            exc = self._exc_info_to_string(err, test)
+            (self._other_failures if n == 1 else self._other_errors).append((info, exc))
+            if self.journal is not None:
+                self.journal.write(_journal_record((n, info, '', exc), self.attempt, 'subtest'))
+            if self.sinks is not None:
+                # e.g. JUnitSink must not leave out a test that only failed in subtests
+                self.sinks.emit((n, info, '', exc), self.attempt)
+            self._failed = None
+            self._mirrorOutput = True
+
+
+# ----------------------------------------------------------------------
+# History
+
+
+def _replace_file(src, dst):
+    """ Atomically move src over dst where the platform allows it """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def _gzip_base64(text):
+    """ text gzip-compressed and base64 encoded, for DecompressionStream in the page """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    return base64.b64encode(data).decode('ascii')
+
+
+class _ChunkWriter(object):
+    """
+    Writes the long outputs of a report to gzip-compressed chunk files in
+    directory (<report>.chunks), about size bytes of output per chunk. A
+    chunk is a script calling reportChunk(url, base64) with the gzipped
+    JSON object of its outputs by key; the page loads it, through a <script>
+    tag so it also works from file://, when one of its outputs is opened.
+    Outputs stream through the compressor, so no chunk is held uncompressed.
+    """
+
+    def __init__(self, directory, url, size=256 * 1024):
+        self.directory = directory
+        self.url = url
+        self.size = size
+        self.count = 0
+        self._compressor = None
+        if os.path.isdir(directory):
+            # chunks of the previous report
+            for name in os.listdir(directory):
+                if name.endswith('.js'):
+                    os.remove(os.path.join(directory, name))
+        else:
+            os.makedirs(directory)
+
+    def add(self, key, text):
+        """ Store text under key; return the URL of its chunk """
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            self._parts = []
+            self._raw = 0
+            data = u'{'
+        else:
+            data = u','
+        data = (data + u'%s:%s' % (json.dumps(key), json.dumps(text))).encode('utf-8')
+        self._parts.append(self._compressor.compress(data))
+        self._raw += len(data)
+        url = '%s/%d.js' % (self.url, self.count)
+        if self._raw >= self.size:
+            self.flush()
+        return url
+
+    def flush(self):
+        """ Write the chunk being filled, if any """
+        if self._compressor is None:
+            return
+        self._parts.append(self._compressor.compress(b'}'))
+        self._parts.append(self._compressor.flush())
+        url = '%s/%d.js' % (self.url, self.count)
+        with open(os.path.join(self.directory, '%d.js' % self.count), 'wb') as f:
+            f.write(('reportChunk(%s, "' % json.dumps(url)).encode('utf-8'))
+            f.write(base64.b64encode(b''.join(self._parts)))
+            f.write(b'");\n')
+        self.count += 1
+        self._compressor = self._parts = None
+
+
+class JsonlHistory(object):
+    """
+    Append-only run history kept next to a report.
+
+    Each run is one JSON line in the log (<report>.history.jsonl), so saving
+    a run is a single append whatever the history length. Up to ``keep``
+    runs are retained; once the log holds twice that, it is compacted by
+    rewriting only the retained runs. The number of lines in the log is
+    kept in the rollup file, so telling when never reads the log.
+
+    The report page loads a small generated index (<report>.json) holding
+    the latest ``index_size`` runs as ``var data`` (or, with ``compress``,
+    gzipped and base64 encoded as ``var data_gz``) and the trend rollups as
+    ``var rollup``. Daily and weekly rollups are kept in <report>.rollup.json
+    and updated per run, so the chart never has to walk the whole history.
+    """
+
+    BLOCK = 64 * 1024
+    # rollup buckets kept for the trend chart
+    ROLLUP_LIMITS = {'daily': 400, 'weekly': 260}
+
+    def __init__(self, path, index_path, keep=10, index_size=None, compress=False):
+        self.path = path
+        self.index_path = index_path
+        self.compress = compress
+        self.rollup_path = os.path.splitext(index_path)[0] + '.rollup.json'
+        self.keep = keep
+        self.index_size = min(index_size or keep, keep)
+
+    def ensure(self):
+        if not os.path.exists(self.path):
+            self._migrate()
+        if not os.path.exists(self.rollup_path):
+            self._write_rollup(self._build_rollup())
+        if not os.path.exists(self.index_path):
+            self._write_index(self.tail(self.index_size), self._read_rollup())
+
+    def append(self, entry):
+        # read before the append, a rollup rebuilt from the log must not count the entry yet
+        rollup = self._read_rollup()
+        with _span('history append', 'history'):
+            line = json.dumps(entry) + '\n'
+            with open(self.path, 'a') as f:
+                f.write(line)
+        lines = rollup.get('lines')
+        # rollup files written before the count was kept
+        lines = self._count_lines() if lines is None else lines + 1
+        if lines > 2 * self.keep:
+            with _span('history compact', 'history'):
+                entries = self.tail(self.keep)
+                self._compact(entries)
+                lines = len(entries)
+        with _span('history rollup', 'history'):
+            rollup['lines'] = lines
+            self._add_to_rollup(rollup, entry)
+            self._write_rollup(rollup)
+        with _span('history index', 'history'):
+            self._write_index(self.tail(self.index_size), rollup)
+
+    def tail(self, n):
+        """ Return the latest n runs, oldest first """
+        return self._read_tail(n)[0]
+
+    def __iter__(self):
+        """ Iterate over every run in the log, oldest first """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    try:
+                        yield json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        pass
+
+    def _read_tail(self, n):
+        """
+        Read the last n complete lines by seeking back from the end of the
+        log. Returns the parsed runs and the offset where the first one starts.
+        """
+        if not os.path.exists(self.path):
+            return [], 0
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = pos = f.tell()
+            buf = b''
+            while pos > 0 and buf.count(b'\n') <= n:
+                step = min(self.BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+        # the last item is whatever follows the final newline: normally
+        # empty, or a line torn by a crash that is not counted
+        lines = buf.split(b'\n')
+        lines = lines[:-1][-n:] if n else []
+        offset = size - len(buf.split(b'\n')[-1]) - sum(len(line) + 1 for line in lines)
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                pass
+        return entries, offset
+
+    def _count_lines(self):
+        """ The number of complete lines in the log """
+        count = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for block in iter(lambda: f.read(self.BLOCK), b''):
+                    count += block.count(b'\n')
+        return count
+
+    def _compact(self, entries):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        _replace_file(tmp, self.path)
+
+    def _write_index(self, entries, rollup):
+        trend = dict((scale, self._rollup_series(rollup[scale])) for scale in self.ROLLUP_LIMITS if scale in rollup)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            if self.compress:
+                f.write('var data = [];\nvar data_gz = "%s";\n' % _gzip_base64(json.dumps(entries)))
+            else:
+                f.write('var data = ' + json.dumps(entries) + ';\n')
+            f.write('var rollup = ' + json.dumps(trend) + ';\n')
+        _replace_file(tmp, self.index_path)
+
+    @staticmethod
+    def _rollup_keys(entry):
+        """ Return the daily and weekly bucket names of a run """
+        day = entry.get('startTime', '')[:10]
+        try:
+            year, week, _ = datetime.datetime.strptime(day, '%Y-%m-%d').isocalendar()
+        except ValueError:
+            return None
+        return {'daily': day, 'weekly': '%d-W%02d' % (year, week)}
+
+    def _add_to_rollup(self, rollup, entry):
+        keys = self._rollup_keys(entry)
+        if keys is None:
+            return
+        counts = [1] + [int(entry.get(k) or 0) for k in ('success', 'fail', 'error')]
+        for scale, key in keys.items():
+            buckets = rollup.setdefault(scale, {})
+            bucket = buckets.setdefault(key, [0, 0, 0, 0])
+            for i, c in enumerate(counts):
+                bucket[i] += c
+            limit = self.ROLLUP_LIMITS[scale]
+            if len(buckets) > limit:
+                for old in sorted(buckets)[:len(buckets) - limit]:
+                    del buckets[old]
+
+    @staticmethod
+    def _rollup_series(buckets):
+        """ Turn {bucket: [runs, success, fail, error]} into the chart's rate rows """
+        series = []
+        for key in sorted(buckets):
+            runs, success, fail, error = buckets[key]
+            total = float(success + fail + error) or 1.0
+            series.append([key, runs, round(success / total * 100, 2),
+                           round(fail / total * 100, 2), round(error / total * 100, 2)])
+        return series
+
+    def _read_rollup(self):
+        try:
+            with open(self.rollup_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return self._build_rollup()
+
+    def _build_rollup(self):
+        rollup = {}
+        for entry in self:
+            self._add_to_rollup(rollup, entry)
+        rollup['lines'] = self._count_lines()
+        return rollup
+
+    def _write_rollup(self, rollup):
+        tmp = self.rollup_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(rollup, f)
+        _replace_file(tmp, self.rollup_path)
+
+    def _migrate(self):
+        """ Seed the log from an index written by an older version, if any """
+        entries = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                content = f.read().decode('utf-8')
+            try:
+                # older versions stored a Python literal rather than JSON
+                entries = ast.literal_eval(content.split(' = ', 1)[1])
+            except (IndexError, ValueError, SyntaxError):
+                sys.stderr.write(u"JSON初始化内容有误! 初始化内容’var data = []‘")
+        self._compact(entries[-self.keep:] if self.keep else [])
+
+
+# ----------------------------------------------------------------------
+# Journal
+
+
+_JOURNAL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class ResultSink(object):
+    """
+    Receiver of the results of a run, given to HTMLTestRunner(sinks=...).
+    The ResultPipeline calls start(header) with the journal start record,
+    write(record) with the journal record of each finished test (see
+    _journal_record) and close() after the run, all on its writer thread.
+    """
+
+    def start(self, header):
+        pass
+
+    def write(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+class ResultJournal(ResultSink):
+    """
+    Crash-safe log of a run next to its report (<report>.journal.jsonl):
+    a 'start' line describing the run, then a line per result entry, per
+    failed subtest ('subtest') and per test that finished without a result
+    entry ('finished', e.g. skipped), appended as soon as they happen. Each line is one O_APPEND
+    write, so pool processes and threads can share the file, and a run
+    that is killed loses at most the line being written. The journal is
+    removed once the report is written; recover_report() rebuilds the
+    report from one that was left behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def start(self, header):
+        """ Begin a new journal, moving aside one left by a run that never finished """
+        if os.path.exists(self.path):
+            sys.stderr.write(u'发现未完成的测试记录 %s，已另存为 %s.prev，'
+                             u'可用 recover_report() 恢复报告\n' % (self.path, self.path))
+            _replace_file(self.path, self.path + '.prev')
+        header = dict(header, type='start')
+        self.write(header)
+
+    def write(self, record):
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        if self._fd is None or self._pid != os.getpid():
+            # a forked pool process opens its own descriptor
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        while line:
+            line = line[os.write(self._fd, line):]
+
+    def close(self):
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def read(self):
+        """ Return the start record and the test records; a torn last line is skipped """
+        header, records = {}, []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                if record.get('type') == 'start':
+                    header = record
+                else:
+                    records.append(record)
+        return header, records
+
+
+def _journal_record(entry, attempt=0, kind='test'):
+    """
+    A journal line for a result entry (n, t, o, e), or with kind='subtest'
+    for a failed subtest, which has no result entry of its own
+    """
+    n, t, o, e = entry
+    record = _test_info(t).to_record()
+    record.update(type=kind, status=n, output=o, error=e, attempt=attempt, time=time.time())
+    return record
+
+
+def _journal_entry(record):
+    """ The result entry (n, t, o, e) of a journal line """
+    return (record['status'], _TestInfo.from_record(record), record.get('output') or '',
+            record.get('error') or '')
+
+
+def _journal_runner(header, stream, kwargs):
+    """ An HTMLTestRunner reporting to stream with the options of a journaled run """
+    options = dict(title=header.get('title'), description=header.get('description'),
+                   verbosity=header.get('verbosity', 1), retry=header.get('retry', 0),
+                   save_last_try=header.get('save_last_try', False))
+    options.update(kwargs)
+    runner = HTMLTestRunner(stream=stream, **options)
+    runner.startTime = datetime.datetime.strptime(header['startTime'], _JOURNAL_TIME_FORMAT)
+    return runner
+
+
+def recover_report(journal, report=None, **kwargs):
+    """
+    Build the report and history entry of a run that was killed, from the
+    journal it left behind. report is the HTML file to write, by default
+    the one the run was writing; kwargs are passed to HTMLTestRunner.
+    Tests the run never got to are reported as not run; tests that ran
+    without a result entry (skipped, or failed only in subtests) are not.
+    The journal is removed once the report is written. Raises ValueError
+    if the journal has no start line, e.g. it is not a journal or was cut
+    off in it.
+    """
+    header, records = ResultJournal(journal).read()
+    if not header:
+        raise ValueError(u'%s 中没有完整的开始记录，不是journal文件或已损坏，无法恢复报告' % journal)
+    with open(report or header['report'], 'wb') as stream:
+        runner = _journal_runner(header, stream, kwargs)
+        result = _TestResult()
+        attempts = OrderedDict()
+        extra = []
+        for record in records:
+            tid = record['id']
+            if record.get('type') == 'finished':
+                result.started.add(tid)
+                result.testsRun += 1
+                continue
+            entry = _journal_entry(record)
+            if record.get('type') == 'subtest':
+                # retries do not keep their subtest failures either
+                if not record.get('attempt'):
+                    (result._other_failures if entry[0] == 1 else result._other_errors).append((entry[1], entry[3]))
+                continue
+            result.testsRun += 1
+            if not record.get('attempt'):
+                result.result.append(entry)
+                result._count(entry)
+                if entry[0]:
+                    attempts.setdefault(tid, [entry])
+            elif tid in attempts:
+                attempts[tid].append(entry)
+            else:
+                extra.append(entry)
+            result.started.add(tid)
+        result._failed = None
+        runner._fold_attempts(result, attempts, extra)
+        for tid, cls in header.get('tests', []):
+            if tid not in result.started:
+                entry = (3, _TestInfo.from_record(dict(id=tid, str=tid, cls=cls)), '', '')
+                result.result.append(entry)
+                result._count(entry)
+        runner.stopTime = datetime.datetime.fromtimestamp(records[-1]['time']) if records else runner.startTime
+        runner.generateReport(None, result)
+    os.remove(journal)
+    return result
+
+
+def merge_shards(artifacts, report, **kwargs):
+    """
+    Build one report and one history entry from the result artifacts
+    (<report>.shard-i-of-n.jsonl) written by the shards of a run, e.g. on
+    different CI machines. kwargs are passed to HTMLTestRunner. Missing
+    shards are warned about on stderr; shards that partitioned the suite
+    differently raise ValueError, their tests may be duplicated or missing.
+    """
+    if not artifacts:
+        raise ValueError(u'没有分片结果文件(.shard-i-of-n.jsonl)可以合并')
+    shards = sorted((ResultJournal(path).read() for path in artifacts), key=lambda shard: shard[0]['shard'])
+    headers = [header for header, records in shards]
+    count = headers[0]['shard'][1]
+    missing = sorted(set(range(1, count + 1)) - set(header['shard'][0] for header in headers))
+    if missing:
+        sys.stderr.write(u'缺少分片 %s (共%d个)，报告中没有这些分片的用例\n' % (missing, count))
+    if len(set(header.get('plan') for header in headers)) > 1:
+        raise ValueError(u'各分片的用例或shard_durations不一致，划分结果不同，用例可能重复或遗漏: %s'
+                         % ', '.join('%d/%d %s' % (tuple(header['shard']) + (header.get('plan'),))
+                                     for header in headers))
+    with open(report, 'wb') as stream:
+        runner = _journal_runner(min(headers, key=lambda header: header['startTime']), stream, kwargs)
+        result = _TestResult()
+        for header, records in shards:
+            for key, times in header.get('fixtures', {}).items():
+                result.fixture_times.setdefault(key, {}).update(times)
+            for record in records:
+                kind = record.get('type')
+                if kind == 'finished':
+                    # e.g. skipped
+                    result.started.add(record['id'])
+                    result.testsRun += 1
+                    continue
+                entry = _journal_entry(record)
+                if kind == 'subtest':
+                    (result._other_failures if entry[0] == 1 else result._other_errors).append((entry[1], entry[3]))
+                    continue
+                result.result.append(entry)
+                result._count(entry)
+                if entry[0] != 3:
+                    result.started.add(record['id'])
+                    result.testsRun += 1
+        runner.stopTime = max(datetime.datetime.strptime(header['stopTime'], _JOURNAL_TIME_FORMAT)
+                              for header in headers)
+        runner.generateReport(None, result)
+    return result
+
+
+# ----------------------------------------------------------------------
+# Result sinks
+
+
+class JsonlSink(ResultJournal):
+    """
+    JSONL feed of a run at path for other tools: the start record, then one
+    line per finished test as it finishes, in the journal format. The file
+    is rewritten by every run.
+    """
+
+    def start(self, header):
+        self.remove()
+        self.write(dict(header, type='start'))
+
+
+# characters XML 1.0 does not allow, e.g. the escapes of colored output
+_XML_ILLEGAL = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xml_text(text):
+    return saxutils.escape(_XML_ILLEGAL.sub(u'', _unicode(text or u'')))
+
+
+def _xml_attr(text):
+    return saxutils.quoteattr(_XML_ILLEGAL.sub(u'', _unicode(text or u'')))
+
+
+class JUnitSink(ResultSink):
+    """
+    JUnit XML report of a run at path, for CI servers, with one testsuite
+    per TestCase class. The last attempt of a retried test is its result;
+    the earlier failed attempts are kept as rerunFailure/rerunError.
+    Not run tests are skipped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._header = {}
+        self._cases = OrderedDict()
+
+    def start(self, header):
+        self._header = header
+        self._cases.clear()
+
+    def write(self, record):
+        reruns = u''
+        previous = self._cases.get(record['id'])
+        if previous is not None and record.get('attempt'):
+            reruns = previous['reruns'] + self._outcome(previous, u'rerun')
+        self._cases[record['id']] = dict(
+            status=record['status'], duration=record.get('duration') or 0, error=record.get('error'),
+            output=record.get('output'), cls=record['cls'], reruns=reruns)
+
+    @staticmethod
+    def _outcome(case, prefix=u''):
+        """ The failure, error or skipped element of case, or u'' if it passed """
+        n = case['status']
+        if n == 3:
+            return prefix and u'' or u'<skipped message="not run"/>'
+        if n not in (1, 2):
+            return u''
+        lines = (case['error'] or u'').strip().splitlines()
+        message = lines and lines[-1] or u''
+        tag = (n == 1 and u'failure' or u'error')
+        if prefix:
+            tag = prefix + tag.capitalize()
+        return u'<%s message=%s type=%s>%s</%s>' % (
+            tag, _xml_attr(message), _xml_attr(message.split(u':', 1)[0]), _xml_text(case['error']), tag)
 
-    def startTest(self, test):
-        test.imgs = []
-        TestResult.startTest(self, test)
-        # just one buffer for both stdout and stderr
-        self.outputBuffer.seek(0)
-        self.outputBuffer.truncate()
-        stdout_redirector.fp = self.outputBuffer
-        stderr_redirector.fp = self.outputBuffer
-        self.stdout0 = sys.stdout
-        self.stderr0 = sys.stderr
-        sys.stdout = stdout_redirector
-        sys.stderr = stderr_redirector
+    def close(self):
+        suites = OrderedDict()
+        for tid, case in self._cases.items():
+            suites.setdefault(u'%s.%s' % tuple(case['cls'][:2]), []).append((tid, case))
+        parts = []
+        totals = [0, 0, 0, 0, 0.0]
+        for name, cases in suites.items():
+            counts = [len(cases), 0, 0, 0, sum(case['duration'] for tid, case in cases)]
+            body = []
+            for tid, case in cases:
+                if case['status'] in (1, 2, 3):
+                    counts[case['status']] += 1
+                short = tid[len(name) + 1:] if tid.startswith(name + u'.') else tid
+                body.append(u'<testcase classname=%s name=%s time="%.3f">%s%s' % (
+                    _xml_attr(name), _xml_attr(short), case['duration'], self._outcome(case), case['reruns']))
+                if case['output']:
+                    body.append(u'<system-out>%s</system-out>' % _xml_text(case['output']))
+                body.append(u'</testcase>\n')
+            parts.append(u'<testsuite name=%s tests="%d" failures="%d" errors="%d" skipped="%d" time="%.3f">\n'
+                         % ((_xml_attr(name),) + tuple(counts)))
+            parts.extend(body)
+            parts.append(u'</testsuite>\n')
+            totals = [total + count for total, count in zip(totals, counts)]
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write((u'<testsuites name=%s tests="%d" failures="%d" errors="%d" skipped="%d" time="%.3f">\n'
+                     % ((_xml_attr(self._header.get('title')),) + tuple(totals))).encode('utf-8'))
+            for part in parts:
+                f.write(part.encode('utf-8'))
+            f.write(b'</testsuites>\n')
+        _replace_file(self.path + '.tmp', self.path)
 
-    def complete_output(self):
-        """
-        Disconnect output redirection and return buffer.
-        Safe to call multiple times.
-        """
-        if self.stdout0:
-            sys.stdout = self.stdout0
-            sys.stderr = self.stderr0
-            self.stdout0 = None
-            self.stderr0 = None
-        return self.outputBuffer.getvalue()
 
-    def stopTest(self, test):
-        # Usually one of addSuccess, addError or addFailure would have been called.
-        # But there are some path in unittest that would bypass this.
-        # We must disconnect stdout in stopTest(), which is guaranteed to be called.
-        if self.retry:
-            if self.status == 1:
-                self.trys += 1
-                if self.trys <= self.retry:
-                    if self.save_last_try:
-                        t = self.result.pop(-1)
-                        if t[0]==1:
-                            self.failure_count-=1
-                        else:
-                            self.error_count -= 1
-                    test=copy.copy(test)
-                    sys.stderr.write("Retesting... ")
-                    sys.stderr.write(str(test))
-                    sys.stderr.write('..%d \n' % self.trys)
-                    try:
-                        doc = test._testMethodDoc or ''
-                    except Exception:
-                        doc = ''
-                    if doc.find('_retry')!=-1:
-                        doc = doc[:doc.find('_retry')]
-                    desc ="%s_retry:%d" %(doc, self.trys)
-                    if not PY3K:
-                        if isinstance(desc, str):
-                            desc = desc.decode("utf-8")
-                    test._testMethodDoc = desc
-                    test(self)
-                else:
-                    self.status = 0
-                    self.trys = 0
-        self.complete_output()
+class ResultPipeline(object):
+    """
+    Hands the finished tests of a run to sinks (ResultSink objects) on a
+    background writer thread, so serializing and writing them overlaps
+    with the tests. The queue holds at most queue_size tests; a test only
+    waits when the writer is that far behind. A sink that raises is
+    reported on stderr and dropped, the run goes on.
+    """
 
-    def addSuccess(self, test):
-        self.success_count += 1
-        self.status = 0
-        TestResult.addSuccess(self, test)
-        output = self.complete_output()
-        self.result.append((0, test, output, ''))
-        if self.verbosity > 1:
-            sys.stderr.write('ok ')
-            sys.stderr.write(str(test))
-            sys.stderr.write('\n')
-        else:
-            sys.stderr.write('.')
+    def __init__(self, sinks, queue_size=1024):
+        self.sinks = list(sinks)
+        self._queue = Queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
 
-    def addError(self, test, err):
-        self.error_count += 1
-        self.status = 1
-        TestResult.addError(self, test, err)
-        _, _exc_str = self.errors[-1]
-        output = self.complete_output()
-        self.result.append((2, test, output, _exc_str))
-        if not getattr(test, "driver",""):
-            pass
-        else:
+    def start(self, header):
+        self._queue.put(('start', header))
+
+    def emit(self, entry, attempt=0):
+        """ Send a result entry (n, t, o, e) of the given retry round to the sinks """
+        self._queue.put(('write', (entry, attempt)))
+
+    def close(self):
+        """ Wait for the sinks to write everything and close them """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            method, arg = item
+            if method == 'write':
+                # serialized here, off the test thread
+                arg = _journal_record(*arg)
+            self._call(method, arg)
+        self._call('close')
+
+    def _call(self, method, *args):
+        for sink in list(self.sinks):
             try:
-                driver = getattr(test, "driver")
-                test.imgs.append(driver.get_screenshot_as_base64())
-            except Exception:
-                pass
-        if self.verbosity > 1:
-            sys.stderr.write('E  ')
-            sys.stderr.write(str(test))
-            sys.stderr.write('\n')
-        else:
-            sys.stderr.write('E')
+                getattr(sink, method)(*args)
+            except Exception as e:
+                sys.stderr.write(u'结果输出 %s 出错，已停用: %r\n' % (sink.__class__.__name__, e))
+                self.sinks.remove(sink)
 
-    def addFailure(self, test, err):
-        self.failure_count += 1
-        self.status = 1
-        TestResult.addFailure(self, test, err)
-        _, _exc_str = self.failures[-1]
-        output = self.complete_output()
-        self.result.append((1, test, output, _exc_str))
-        if not getattr(test, "driver",""):
+
+# ----------------------------------------------------------------------
+# Coordinator
+
+
+def _send(stream, message):
+    stream.write((json.dumps(message) + '\n').encode('utf-8'))
+    stream.flush()
+
+
+def _receive(stream):
+    """ The next message on stream, None once the other side has gone or sent something garbled """
+    try:
+        line = stream.readline()
+    except socket.error:
+        return None
+    if not line.endswith(b'\n'):
+        return None
+    try:
+        message = json.loads(line.decode('utf-8'))
+    except ValueError:
+        # UnicodeDecodeError is a ValueError too
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def _parse_address(address):
+    """ (host, port) of 'host:port' or a (host, port) pair """
+    if isinstance(address, str):
+        host, _, port = address.rpartition(':')
+        return host or '127.0.0.1', int(port)
+    return tuple(address)
+
+
+class Coordinator(object):
+    """
+    Hands the work units of a run (one TestCase class each) to worker
+    processes over TCP, the next unit to whichever worker is free, so a
+    few slow classes do not leave the other workers idle. workers worker
+    processes are started locally; more can connect from any host with
+    'python -m HTMLTestRunner_Chart worker host:port', as long as the test
+    modules are importable there, since workers load the tests by id.
+
+    Workers must send token in their hello; local workers are given it, a
+    random one unless token is set. Listening on other than a loopback
+    address requires an explicit token, which remote workers read from the
+    HTMLTESTRUNNER_TOKEN environment variable. Nothing sent over the wire
+    names a file: the journal is kept by the coordinator and output_dir is
+    a setting of each worker. run() gives up on its tests when no worker
+    has been connected for connect_timeout seconds.
+
+    Messages are JSON, one per line:
+        worker: {"type": "hello", "pid": ..., "local": bool, "token": ...}
+        coordinator: {"type": "unit", "tests": [[id, doc], ...], "result": {verbosity, output_limit, attempt}}
+        worker: {"type": "result", "records": [...], "testsRun": n, "started": [...], "fixtures": {...}}
+        coordinator: {"type": "stop"}
+    A unit whose worker disconnects is handed to another worker once; if
+    that one is lost too, its tests are reported as errors.
+    """
+
+    # loopback addresses only local processes can connect to
+    LOOPBACK = ('127.0.0.1', 'localhost', '::1')
+
+    def __init__(self, address=('127.0.0.1', 0), workers=0, screenshot_args=None, token=None,
+                 connect_timeout=60, output_dir=None):
+        address = self._check_token(address, token)
+        self.token = token or binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.connect_timeout = connect_timeout
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(64)
+        self.address = self.server.getsockname()[:2]
+        # jobs are [index, message, fallback records, times lost]
+        self._jobs = Queue.Queue()
+        self._done = Queue.Queue()
+        self._lock = threading.Lock()
+        self._connections = 0
+        accept = threading.Thread(target=self._accept)
+        accept.daemon = True
+        accept.start()
+        host, port = self.address
+        local = ('127.0.0.1' if host in ('0.0.0.0', '') else host, port)
+        self.processes = [multiprocessing.Process(target=_socket_worker,
+                                                  args=(local, screenshot_args, _stop_signal, self.token, output_dir))
+                          for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+        sys.stderr.write('Coordinator listening on %s:%d, %d local workers\n' % (host, port, workers))
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except (socket.error, OSError):
+                # the server socket was closed
+                return
+            serve = threading.Thread(target=self._serve, args=(conn,))
+            serve.daemon = True
+            serve.start()
+
+    def _serve(self, conn):
+        """ Feed one worker connection until the coordinator closes """
+        stream = conn.makefile('rwb')
+        hello = _receive(stream)
+        if not hello or hello.get('type') != 'hello' or not self._authorized(hello.get('token')):
+            stream.close()
+            conn.close()
+            return
+        with self._lock:
+            self._connections += 1
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    # closing: pass the sentinel on to the other connections
+                    self._jobs.put(None)
+                    _send(stream, dict(type='stop'))
+                    return
+                try:
+                    _send(stream, job[1])
+                except socket.error:
+                    reply = None
+                else:
+                    reply = _receive(stream)
+                if reply is None or reply.get('type') != 'result':
+                    # gone, or answered with something garbled
+                    self._lost(job)
+                    return
+                self._done.put((job[0], reply, hello.get('local')))
+        except socket.error:
             pass
-        else:
+        finally:
+            with self._lock:
+                self._connections -= 1
             try:
-                driver = getattr(test, "driver")
-                test.imgs.append(driver.get_screenshot_as_base64())
-            except Exception as e:
+                stream.close()
+                conn.close()
+            except socket.error:
                 pass
-        if self.verbosity > 1:
-            sys.stderr.write('F  ')
-            sys.stderr.write(str(test))
-            sys.stderr.write('\n')
+
+    @classmethod
+    def _check_token(cls, address, token):
+        """ The (host, port) of address; ValueError if it is reachable from other hosts without a token """
+        address = _parse_address(address)
+        if token is None and address[0] not in cls.LOOPBACK:
+            raise ValueError(u'监听%s时需要指定token，worker通过环境变量HTMLTESTRUNNER_TOKEN传入' % address[0])
+        return address
+
+    def _authorized(self, token):
+        if not isinstance(token, type(u'')):
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def _lost(self, job):
+        """ Hand the job of a worker that went away to another one, or give up on it """
+        job[3] += 1
+        if job[3] < 2:
+            self._jobs.put(job)
         else:
-            sys.stderr.write('F')
+            self._done.put((job[0], self._error_reply(job, u'worker进程在执行该用例时退出'), True))
+
+    @staticmethod
+    def _error_reply(job, error):
+        records = [dict(record, status=2, error=error) for record in job[2]]
+        return dict(records=records, testsRun=0, started=[], fixtures={})
+
+    def _cancel(self):
+        """ Take the jobs no worker has started off the queue """
+        jobs = []
+        while True:
+            try:
+                jobs.append(self._jobs.get_nowait())
+            except Queue.Empty:
+                return jobs
+
+    def run(self, units, result, result_kwargs):
+        """
+        Run units (TestSuites) on the workers and merge their results into
+        result, in unit order. The coordinator journals the results itself,
+        so remote workers need no access to the journal. Raises ValueError
+        before running anything if a test cannot be loaded by its id.
+        """
+        result_kwargs = dict((name, value) for name, value in result_kwargs.items() if name in _WIRE_RESULT_KWARGS)
+        units = [(unit, list(_iter_tests(unit))) for unit in units]
+        for unit, cases in units:
+            for case in cases:
+                _check_loadable(case)
+        for index, (unit, cases) in enumerate(units):
+            tests = [[case.id(), getattr(case, '_testMethodDoc', None)] for case in cases]
+            fallback = [dict(_TestInfo(case).to_record(), output='', attempt=result.attempt) for case in cases]
+            self._jobs.put([index, dict(type='unit', tests=tests, result=result_kwargs), fallback, 0])
+        replies = {}
+        skipped = set()
+        merged = 0
+        idle = time.time()
+        while merged < len(units):
+            try:
+                index, reply, shares_signal = self._done.get(timeout=1)
+            except Queue.Empty:
+                if self._connections or any(process.is_alive() for process in self.processes):
+                    idle = time.time()
+                elif self.processes or time.time() - idle >= self.connect_timeout:
+                    # every worker is gone, or none connected in time: nothing
+                    # else will pick up the rest
+                    for job in self._cancel():
+                        self._done.put((job[0], self._error_reply(job, u'没有可用的worker'), True))
+                continue
+            replies[index] = reply
+            if _stop_signal is not None:
+                if not shares_signal:
+                    for record in reply['records']:
+                        if record['status'] in (1, 2):
+                            _stop_signal.failed()
+                if _stop_signal.is_set():
+                    skipped.update(job[0] for job in self._cancel())
+            while merged < len(units) and (merged in replies or merged in skipped):
+                if merged in replies:
+                    self._merge(replies.pop(merged), result)
+                merged += 1
+
+    @staticmethod
+    def _merge(reply, result):
+        if result.journal:
+            for record in reply['records'] + reply.get('others', []):
+                result.journal.write(record)
+            recorded = set(record['id'] for record in reply['records'])
+            for tid in reply['started']:
+                if tid not in recorded:
+                    result.journal.write(dict(type='finished', id=tid, attempt=result.attempt, time=time.time()))
+        others = [_journal_entry(record) for record in reply.get('others', [])]
+        result.merge(dict(result=[_journal_entry(record) for record in reply['records']],
+                          testsRun=reply['testsRun'], started=reply['started'],
+                          fixture_times=reply['fixtures'],
+                          other_failures=[(t, e) for n, t, o, e in others if n == 1],
+                          other_errors=[(t, e) for n, t, o, e in others if n == 2]))
+
+    def close(self):
+        """ Stop the workers and the server """
+        self._jobs.put(None)
+        for process in self.processes:
+            process.join()
+        self.server.close()
+
+
+def _check_loadable(case):
+    """ Raise ValueError unless a worker can load case by its id, as Coordinator workers do """
+    cls = type(case)
+    module = sys.modules.get(cls.__module__)
+    if cls.__module__ == '__main__':
+        raise ValueError(u'executor="socket"的worker按id加载用例，无法加载__main__中的用例%s，'
+                         u'请把用例放在可以import的模块里' % case.id())
+    if getattr(module, cls.__name__, None) is not cls or \
+            case.id() != '%s.%s.%s' % (cls.__module__, cls.__name__, getattr(case, '_testMethodName', '')):
+        raise ValueError(u'executor="socket"的worker按id加载用例，无法加载动态生成的用例%s' % case.id())
+
+
+# the _TestResult kwargs a Coordinator sends to its workers; paths are not
+# taken from the wire
+_WIRE_RESULT_KWARGS = ('verbosity', 'output_limit', 'attempt')
+
+
+def _socket_worker(address, screenshot_args=None, stop_signal=_MISSING, token=None, output_dir=None):
+    """
+    Run the units handed out by the Coordinator at address until it says
+    stop. Local workers share the run's _StopSignal; remote ones are only
+    stopped between units. token defaults to $HTMLTESTRUNNER_TOKEN.
+    """
+    local = stop_signal is not _MISSING
+    if local:
+        _init_pool_process(stop_signal)
+    deadline = time.time() + 30
+    while True:
+        # a remote worker may be started before the coordinator listens
+        try:
+            conn = socket.create_connection(_parse_address(address))
+            break
+        except socket.error:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+    stream = conn.makefile('rwb')
+    if token is None:
+        token = os.environ.get('HTMLTESTRUNNER_TOKEN')
+    _send(stream, dict(type='hello', pid=os.getpid(), local=local, token=token))
+    loader = unittest.TestLoader()
+    while True:
+        message = _receive(stream)
+        if message is None or message.get('type') != 'unit':
+            break
+        _CLASS_INFOS.clear()
+        unit = unittest.TestSuite()
+        for tid, doc in message['tests']:
+            for case in _iter_tests(loader.loadTestsFromName(tid)):
+                if doc is not None:
+                    # e.g. the _retry:N marker of a retried test
+                    case._testMethodDoc = doc
+                unit.addTest(case)
+        kwargs = dict((name, value) for name, value in message['result'].items() if name in _WIRE_RESULT_KWARGS)
+        kwargs['output_dir'] = output_dir
+        attempt = kwargs.get('attempt', 0)
+        snapshot = _run_unit((unit, kwargs, screenshot_args, True))
+        others = [_journal_record((1, t, '', e), attempt, 'subtest') for t, e in snapshot['other_failures']] + \
+            [_journal_record((2, t, '', e), attempt, 'subtest') for t, e in snapshot['other_errors']]
+        _send(stream, dict(type='result', records=[_journal_record(entry, attempt) for entry in snapshot['result']],
+                           testsRun=snapshot['testsRun'], started=snapshot['started'],
+                           fixtures=snapshot['fixture_times'], others=others))
+    stream.close()
+    conn.close()
 
 
 class HTMLTestRunner(Template_mixin):
+    # outputs longer than this many characters go to chunk files with compress
+    CHUNK_MIN = 1024
 
-    def __init__(self, stream=sys.stdout, verbosity=1, title=None, description=None, retry=0, save_last_try=False):
+    def __init__(self, stream=sys.stdout, verbosity=1, title=None, description=None, retry=0, save_last_try=False,
+                 retry_budget=None, retry_delay=0, retry_workers=None, workers=1, executor='process', streaming=False,
+                 screenshot_dir=None, history_size=10, history_retention=None,
+                 screenshot_workers=2, screenshot_queue=32, screenshot_timeout=10,
+                 screenshot_encoder=None, screenshot_budget=None, output_limit=None, output_dir=None,
+                 report_mode='table', slowest=10, order=None, max_failures=None, time_budget=None,
+                 journal=False, shard=None, shard_durations=None, shard_plan=None, listen=('127.0.0.1', 0), worker_token=None,
+                 worker_timeout=60, assets='cdn', asset_dir=None,
+                 asset_files=(), compress=False, chunk_size=256 * 1024, sinks=(), sink_queue=1024,
+                 profile=None):
         self.stream = stream
+        # workers > 1 runs the suite in a pool, one TestCase class per work unit.
+        # executor is 'process' for CPU-bound suites or 'thread' for I/O-bound
+        # ones (e.g. selenium) that mostly wait on a driver. 'socket' starts a
+        # Coordinator listening on listen ('host:port' or a pair) that hands
+        # classes to workers local worker processes and to any worker that
+        # connects from another host with worker_token, giving up when no
+        # worker is connected for worker_timeout seconds.
+        self.workers = workers
+        self.executor = executor
+        self.listen = listen
+        self.worker_token = worker_token
+        self.worker_timeout = worker_timeout
+        if executor == 'socket':
+            Coordinator._check_token(listen, worker_token)
+        self._coordinator = None
+        # write the report row by row instead of rendering it in memory first
+        self.streaming = streaming
+        # directory for screenshot files; None inlines them as base64
+        self.screenshot_dir = screenshot_dir
+        # screenshots are taken on this many background threads, waiting at
+        # most screenshot_timeout seconds for the driver; 0 takes them inline
+        self.screenshot_workers = screenshot_workers
+        self.screenshot_queue = screenshot_queue
+        self.screenshot_timeout = screenshot_timeout
+        # ScreenshotEncoder applied to captured screenshots (e.g. PillowEncoder),
+        # and the total screenshot bytes allowed in one report
+        self.screenshot_encoder = screenshot_encoder or ScreenshotEncoder()
+        self.screenshot_budget = screenshot_budget
+        self.screenshot_stats = dict(thumbnail=0, dropped=0)
+        # characters of output kept in memory per test; the full output of
+        # longer tests is spilled to a log file in output_dir, if given
+        self.output_limit = output_limit
+        self.output_dir = output_dir
+        # 'cdn' links Bootstrap and ECharts from a CDN and puts the report's
+        # own CSS and JS in the page; 'shared' writes minified, content-hashed
+        # copies of these and of the local libraries in asset_files (e.g. the
+        # paths of bootstrap.min.css and echarts.common.min.js) to asset_dir
+        # (default <report dir>/assets) once and links them, so reports open
+        # offline and share one cached copy; 'inline' puts everything in the page
+        if assets not in ('cdn', 'shared', 'inline'):
+            raise ValueError("assets must be 'cdn', 'shared' or 'inline', not %r" % (assets,))
+        self.assets = assets
+        self.asset_dir = asset_dir
+        self.asset_files = asset_files
+        # compress moves outputs longer than CHUNK_MIN to gzipped chunk files of
+        # about chunk_size bytes, loaded when opened, and gzips the history
+        # index, so the page itself stays small
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self._chunks = None
+        # ResultSinks (e.g. JUnitSink, JsonlSink) sent every finished test
+        # while the run goes on, by a ResultPipeline writer thread with a
+        # queue of sink_queue tests
+        self.sinks = sinks
+        self.sink_queue = sink_queue
+        self._pipeline = None
+        # profile records the phases of the run (True: <report>.trace.json, or
+        # a path) as a Chrome trace, and prints a summary of them to stderr
+        self.profile = profile
+        # 'table' renders every row up front; 'virtual' embeds the results as
+        # JSON and only draws the rows in view, for very large suites
+        self.report_mode = report_mode
+        # number of tests and classes listed as the slowest; 0 hides the list
+        self.slowest = slowest
+        # None runs tests in loader order; 'failed' or 'slow' reorders them
+        # from the history, see _order_tests
+        self.order = order
+        # no test is started once max_failures tests failed or errored, or
+        # time_budget seconds passed; the rest are reported as not run
+        self.max_failures = max_failures
+        self.time_budget = time_budget
+        # finished tests are journaled to this file (True: <report>.journal.jsonl)
+        # so recover_report() can rebuild the report of a killed run. Off by
+        # default: the journal holds a second copy of every output and
+        # screenshot until the report is written
+        self.journal = journal
+        # 'i/n' runs only the i-th of n parts of the suite and writes a
+        # <report>.shard-i-of-n.jsonl artifact for merge_shards() instead of
+        # a history entry. The parts are balanced by the durations in the
+        # shard_durations history log shared by all shards (e.g. the merged
+        # report's .history.jsonl), or by test count without one, never by
+        # local history. A shard whose partition digest is not shard_plan
+        # fails before running anything.
+        self.shard = shard and _parse_shard(shard)
+        self.shard_durations = shard_durations
+        self.shard_plan = shard_plan
+        self._shard_plan = None
+        self._saved_screenshots = set()
+        # number of runs shown on the page, and kept in the history log
+        # (defaults to history_size); the trend chart covers the whole log
+        self.history_size = history_size
+        self.history_retention = history_retention or history_size
+        # failed tests are re-run up to retry times after the whole suite has
+        # run, retry_budget re-runs in all, retry_delay seconds between rounds
+        # and in a pool of retry_workers (default workers). save_last_try
+        # shows only the last attempt, with the earlier ones in its output.
         self.retry = retry
         self.save_last_try = save_last_try
+        self.retry_budget = retry_budget
+        self.retry_delay = retry_delay
+        self.retry_workers = retry_workers or workers
         self.verbosity = verbosity
         self.path = ""
         if title is None:
-            self.title = self.DEFAULT_TITLE
+            self.title = _unicode(self.DEFAULT_TITLE)
         else:
-            self.title = title
+            self.title = _unicode(title)
         if description is None:
-            self.description = self.DEFAULT_DESCRIPTION
+            self.description = _unicode(self.DEFAULT_DESCRIPTION)
         else:
-            self.description = description
+            self.description = _unicode(description)
 
         self.startTime = datetime.datetime.now()
 
     def run(self, test):
         """Run the given test case or test suite."""
-        result = _TestResult(self.verbosity)
-        test(result)
+        global _tracer
+        if not self.profile:
+            return self._run(test)
+        tracer0, _tracer = _tracer, PhaseTracer()
+        try:
+            with _span('run', 'run'):
+                result = self._run(test)
+        finally:
+            tracer, _tracer = _tracer, tracer0
+        self._save_trace(tracer)
+        return result
+
+    def _run(self, test):
+        global _screenshot_service, _stop_signal
+        _CLASS_INFOS.clear()
+        if self.shard:
+            test = self._select_shard(test)
+        if self.order:
+            test = self._order(test)
+        service0, signal0 = _screenshot_service, _stop_signal
+        screenshot_args = self._screenshot_args()
+        _screenshot_service = screenshot_args and ScreenshotService(*screenshot_args)
+        if self.max_failures or self.time_budget is not None:
+            _stop_signal = _StopSignal(self.max_failures, self.time_budget)
+        else:
+            _stop_signal = None
+        # the suite may drop its tests as they run, so find them beforehand;
+        # only retries need the TestCases themselves, and only of the tests
+        # that fail: the others are swapped for their _TestInfo as they pass
+        cases = OrderedDict((case.id(), case if self.retry else _TestInfo(case)) for case in _iter_tests(test)
+                            if isinstance(case, unittest.TestCase))
+        if self.executor == 'socket':
+            # before anything is started or journaled
+            for case in _iter_tests(test):
+                _check_loadable(case)
+        journal = self._journal_path() and ResultJournal(self._journal_path())
+        if journal:
+            journal.start(self._journal_header(cases))
+        if self.sinks:
+            self._pipeline = ResultPipeline(self.sinks, self.sink_queue)
+            self._pipeline.start(self._journal_header(cases))
+        result = _TestResult(stop_signal=_stop_signal, sinks=self._pipeline, **self._result_kwargs())
+        if self.retry:
+            result.cases = cases
+        try:
+            if self.executor == 'socket':
+                self._coordinator = Coordinator(self.listen, self.workers, screenshot_args, self.worker_token,
+                                                self.worker_timeout, self.output_dir)
+            with _span('tests', 'run'):
+                self._run_suite(test, result, self.workers)
+            result.cases = None
+            if self.retry:
+                # e.g. pool and socket runs: only the failed tests are copied for retries
+                failed = set(entry[1].id() for entry in result.result if entry[0])
+                for tid, case in cases.items():
+                    if tid not in failed and isinstance(case, unittest.TestCase):
+                        cases[tid] = _TestInfo(case)
+            if self.retry and not result.shouldStop:
+                self._retry_failed(cases, result)
+            if _stop_signal is not None:
+                self._add_not_run(cases, result)
+            if _screenshot_service:
+                with _span('screenshot drain', 'run'):
+                    _screenshot_service.drain()
+        finally:
+            if self._coordinator:
+                self._coordinator.close()
+                self._coordinator = None
+            if _screenshot_service:
+                _screenshot_service.shutdown()
+            _screenshot_service, _stop_signal = service0, signal0
+            if result.journal:
+                result.journal.close()
+            if self._pipeline:
+                self._pipeline.close()
+                self._pipeline = None
         self.stopTime = datetime.datetime.now()
-        self.generateReport(test, result)
+        with _span('generateReport'):
+            self.generateReport(test, result)
+        if self.shard:
+            self._write_shard_artifact(result)
+        if journal:
+            # the report is written, the journal is no longer needed
+            journal.remove()
         if PY3K:
             # for python3
             # print('\nTime Elapsed: %s' % (self.stopTime - self.startTime),file=sys.stderr)
@@ -1048,18 +3856,339 @@ class HTMLTestRunner(Template_mixin):
             print >> sys.stderr, '\nTime Elapsed: %s' % (self.stopTime - self.startTime)
         return result
 
+    @staticmethod
+    def _add_not_run(cases, result):
+        """ Report the tests a stopped run never started as not run """
+        for tid, case in cases.items():
+            if tid not in result.started:
+                entry = (3, _test_info(case), '', '')
+                result.result.append(entry)
+                result._count(entry)
+                if result.sinks is not None:
+                    result.sinks.emit(entry)
+
+    def _order(self, test):
+        """ Reorder test by self.order, from the runs shown on the page """
+        stats = _history_stats(self._open_history().tail(self.history_size))
+        # pool workers take classes one at a time, so with workers only the
+        # classes are ordered: longest first packs the pool best
+        return _order_tests(test, stats, self.order, grouped=self.workers <= 1 and self.executor != 'socket')
+
+    def _select_shard(self, test):
+        """ The tests of self.shard, balanced by the durations in shard_durations """
+        stats = {}
+        if self.shard_durations:
+            if not os.path.exists(self.shard_durations):
+                raise ValueError(u'shard_durations %s 不存在，各分片需要使用同一份历史记录' % self.shard_durations)
+            history = JsonlHistory(self.shard_durations, self.shard_durations)
+            stats = _history_stats(history.tail(self.history_size))
+        test, self._shard_plan = _shard_tests(test, stats, *self.shard)
+        sys.stderr.write(u'分片 %d/%d 划分: %s\n' % (self.shard + (self._shard_plan,)))
+        if self.shard_plan and self.shard_plan != self._shard_plan:
+            raise ValueError(u'分片划分 %s 与 shard_plan %s 不一致，各分片的用例或shard_durations不同'
+                             % (self._shard_plan, self.shard_plan))
+        return test
+
+    def _trace_path(self):
+        if self.profile is True:
+            return os.path.splitext(self.stream.name)[0] + ".trace.json"
+        return self.profile
+
+    def _save_trace(self, tracer):
+        """ Write the trace of the run and a summary of its spans next to it, and print the summary """
+        path = self._trace_path()
+        tracer.save(path)
+        summary = tracer.summary()
+        with open(os.path.splitext(path)[0] + '.txt', 'w') as f:
+            f.write(summary)
+        sys.stderr.write(u'\n阶段耗时 (%s):\n%s' % (path, summary))
+
+    def _shard_artifact_path(self):
+        return "%s.shard-%d-of-%d.jsonl" % ((os.path.splitext(self.stream.name)[0],) + self.shard)
+
+    def _write_shard_artifact(self, result):
+        """ Write the results of this shard for merge_shards(), in the journal format """
+        path = self._shard_artifact_path()
+        header = self._journal_header({})
+        del header['tests']
+        header.update(type='start', shard=list(self.shard), plan=self._shard_plan,
+                      stopTime=self.stopTime.strftime(_JOURNAL_TIME_FORMAT),
+                      fixtures=result.fixture_times)
+        artifact = ResultJournal(path + '.tmp')
+        artifact.remove()
+        artifact.write(header)
+        for entry in result.result:
+            artifact.write(_journal_record(entry))
+        # failed subtests and tests without a result entry, as in the journal
+        for n, failed in ((1, result._other_failures), (2, result._other_errors)):
+            for t, e in failed:
+                artifact.write(_journal_record((n, t, '', e), kind='subtest'))
+        recorded = set(entry[1].id() for entry in result.result)
+        for tid in sorted(result.started - recorded):
+            artifact.write(dict(type='finished', id=tid, attempt=0, time=time.time()))
+        artifact.close()
+        _replace_file(artifact.path, path)
+
+    def _open_history(self):
+        base = os.path.splitext(self.stream.name)[0]
+        return JsonlHistory(base + ".history.jsonl", base + ".json", self.history_retention, self.history_size,
+                            self.compress)
+
+    def _result_kwargs(self, **kwargs):
+        """ Keyword arguments for the _TestResult objects of a run """
+        kwargs.update(
+            verbosity=self.verbosity,
+            output_limit=self.output_limit,
+            output_dir=self.output_dir,
+            journal=self._journal_path(),
+        )
+        return kwargs
+
+    def _journal_path(self):
+        if self.journal is True:
+            return os.path.splitext(self.stream.name)[0] + ".journal.jsonl"
+        return self.journal or None
+
+    def _journal_header(self, cases):
+        """ The start record of the journal: what recover_report() needs besides the tests """
+        return dict(title=self.title, description=self.description, verbosity=self.verbosity,
+                    retry=self.retry, save_last_try=self.save_last_try,
+                    startTime=self.startTime.strftime(_JOURNAL_TIME_FORMAT),
+                    report=os.path.abspath(self.stream.name),
+                    tests=[[tid, _test_info(case).to_record()['cls']] for tid, case in cases.items()])
+
+    def _screenshot_args(self):
+        if self.screenshot_workers:
+            return (self.screenshot_workers, self.screenshot_queue, self.screenshot_timeout,
+                    self.screenshot_encoder)
+        return None
+
+    def _run_suite(self, test, result, workers):
+        """ Run test into result, in a pool when workers > 1 """
+        if self.executor == 'socket':
+            # the workers time the fixtures they run
+            self._coordinator.run(_split_units(test), result, self._result_kwargs(attempt=result.attempt))
+        elif workers > 1 and self.executor != 'thread':
+            # each pool process times the fixtures it runs
+            self._run_parallel(test, result, workers)
+        else:
+            with _FixtureTimer(test, result.fixture_times):
+                if workers > 1:
+                    self._run_parallel(test, result, workers)
+                else:
+                    test(result)
+
+    def _run_parallel(self, test, result, workers):
+        """
+        Run the work units of test in a process or thread pool and merge the
+        results. Snapshots are merged in unit order, not completion order, so
+        the report is the same whichever worker finishes first.
+        """
+        units = _split_units(test)
+        if not units:
+            return
+        if self.executor != 'thread':
+            self._run_processes(units, result, workers)
+            return
+        # Swap the global streams once for all threads; each thread binds
+        # its own buffer to the redirectors in startTest.
+        pool = ThreadPool(min(workers, len(units)))
+        stdout0, stderr0 = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = stdout_redirector, stderr_redirector
+        try:
+            # threads share the runner's ScreenshotService
+            args = [(unit, self._result_kwargs(redirect=False), None, False) for unit in units]
+            for snapshot in pool.imap(_run_unit, args):
+                self._merge_snapshot(result, snapshot)
+        finally:
+            pool.close()
+            pool.join()
+            sys.stdout, sys.stderr = stdout0, stderr0
+
+    def _run_processes(self, units, result, workers):
+        """
+        Run units on up to workers processes, one unit at a time each, and
+        merge the snapshots in unit order. A unit whose process dies (e.g.
+        os._exit, an OOM kill or a crash) is handed to a new process once;
+        if that one dies too, its tests are reported as errors, as the
+        socket Coordinator does.
+        """
+        # processes start their own ScreenshotService
+        kwargs = self._result_kwargs(redirect=True)
+        screenshot_args = self._screenshot_args()
+        pending = list(range(len(units)))
+        lost = [0] * len(units)
+        busy = {}
+        idle = []
+        replies = {}
+        merged = 0
+        try:
+            while merged < len(units):
+                while pending and len(busy) < workers:
+                    worker = idle.pop() if idle else self._start_pool_process()
+                    index = pending.pop(0)
+                    worker[1].send((units[index], kwargs, screenshot_args, True))
+                    busy[worker] = index
+                for worker in _wait_ready(list(busy)):
+                    index = busy.pop(worker)
+                    try:
+                        replies[index] = worker[1].recv()
+                        idle.append(worker)
+                        continue
+                    except (EOFError, IOError, OSError):
+                        # the process died with the unit
+                        worker[0].join()
+                        worker[1].close()
+                    lost[index] += 1
+                    if lost[index] < 2:
+                        pending.append(index)
+                    else:
+                        replies[index] = self._lost_unit(units[index], result)
+                while merged in replies:
+                    self._merge_snapshot(result, replies.pop(merged))
+                    merged += 1
+        finally:
+            for process, conn in idle:
+                try:
+                    conn.send(None)
+                except (IOError, OSError):
+                    pass
+                process.join()
+                conn.close()
+            # only left busy when the run was interrupted
+            for process, conn in busy:
+                process.terminate()
+                process.join()
+                conn.close()
+
+    @staticmethod
+    def _start_pool_process():
+        conn, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_pool_process, args=(child, _stop_signal, _tracer is not None))
+        process.daemon = True
+        process.start()
+        # so the parent end sees EOF once the process is gone
+        child.close()
+        return process, conn
+
+    @staticmethod
+    def _lost_unit(unit, result):
+        """ The snapshot of a unit whose process died twice: every test an error """
+        error = u'worker进程在执行该用例时退出'
+        entries = [(2, _TestInfo(case), '', error) for case in _iter_tests(unit)]
+        if result.journal:
+            for entry in entries:
+                result.journal.write(_journal_record(entry, result.attempt))
+        return dict(result=entries, testsRun=0, started=[], fixture_times={})
+
+    @staticmethod
+    def _merge_snapshot(result, snapshot):
+        result.merge(snapshot)
+        if 'trace' in snapshot:
+            _tracer.events.extend(snapshot['trace'])
+
+    def _retry_failed(self, cases, result):
+        """
+        Re-run the tests that failed or errored, after the whole suite rather
+        than right after each failure. Each round runs the tests that are
+        still failing as a new suite, with its own class and module fixtures,
+        until they pass, have been retried self.retry times, or retry_budget
+        re-runs have been spent. cases maps test ids to the suite's tests.
+        """
+        # the attempts of each retried test, first one included, by test id
+        attempts = OrderedDict()
+        for entry in result.result:
+            if entry[0] and entry[1].id() in cases:
+                attempts.setdefault(entry[1].id(), [entry])
+        budget = self.retry_budget
+        extra = []
+        for trys in range(1, self.retry + 1):
+            pending = [tid for tid in cases if tid in attempts and
+                       attempts[tid][-1][0] and len(attempts[tid]) == trys]
+            if budget is not None:
+                pending = pending[:budget]
+                budget -= len(pending)
+            if not pending:
+                break
+            if self.retry_delay:
+                time.sleep(self.retry_delay)
+            suite = unittest.TestSuite()
+            for tid in pending:
+                case = copy.copy(cases[tid])
+                sys.stderr.write('Retesting... %s ..%d \n' % (case, trys))
+                if not self.save_last_try:
+                    desc = "%s_retry:%d" % (case._testMethodDoc or '', trys)
+                    if not PY3K and isinstance(desc, str):
+                        desc = desc.decode("utf-8")
+                    case._testMethodDoc = desc
+                suite.addTest(case)
+            retried = _TestResult(stop_signal=_stop_signal, sinks=self._pipeline,
+                                  **self._result_kwargs(attempt=trys))
+            with _span('retry %d' % trys, 'run'):
+                self._run_suite(suite, retried, self.retry_workers)
+            if retried.journal:
+                retried.journal.close()
+            result.testsRun += retried.testsRun
+            # the retried classes and modules set up again; their fixtures
+            # add to the time of the first run
+            for key, times in retried.fixture_times.items():
+                merged = result.fixture_times.setdefault(key, {})
+                for name, seconds in times.items():
+                    merged[name] = merged.get(name, 0) + seconds
+            for entry in retried.result:
+                if entry[1].id() in attempts:
+                    attempts[entry[1].id()].append(entry)
+                else:
+                    # e.g. an error in setUpClass of the retried class
+                    extra.append(entry)
+        self._fold_attempts(result, attempts, extra)
+
+    def _fold_attempts(self, result, attempts, extra):
+        """
+        Put the retries into result.result: with save_last_try the last
+        attempt replaces the first one and keeps the others in t.attempts,
+        otherwise every attempt gets its own row after the first.
+        """
+        rows = []
+        for entry in result.result:
+            tries = attempts.get(entry[1].id())
+            if not tries or tries[0] is not entry or len(tries) == 1:
+                rows.append(entry)
+            elif self.save_last_try:
+                final = tries[-1]
+                final[1].attempts = [dict(status=n, duration=getattr(t, 'duration', None),
+                                          output=self._test_output(o, e)) for n, t, o, e in tries[:-1]]
+                result._count(entry, -1)
+                result._count(final)
+                rows.append(final)
+            else:
+                for retry in tries[1:]:
+                    result._count(retry)
+                rows.extend(tries)
+        for entry in extra:
+            result._count(entry)
+        result.result = rows + extra
+        result._failed = None
+
     def sortResult(self, result_list):
+        with _span('sortResult'):
+            return self._sort_result(result_list)
+
+    def _sort_result(self, result_list):
         # unittest does not seems to run in any particular order.
         # Here at least we want to group them together by class.
         rmap = {}
         classes = []
         for n,t,o,e in result_list:
-            cls = t.__class__
-            if cls not in rmap:
-                rmap[cls] = []
+            # results merged from pool workers carry a _TestClassInfo
+            cls = getattr(t, 'test_class', None) or t.__class__
+            # keyed by name, so a class and its _TestClassInfo go together
+            key = _class_key(cls)
+            if key not in rmap:
+                rmap[key] = []
                 classes.append(cls)
-            rmap[cls].append((n,t,o,e))
-        r = [(cls, rmap[cls]) for cls in classes]
+            rmap[key].append((n,t,o,e))
+        r = [(cls, rmap[_class_key(cls)]) for cls in classes]
         return r
 
     def getReportAttributes(self, result):
@@ -1073,204 +4202,562 @@ class HTMLTestRunner(Template_mixin):
         if result.success_count: status.append(u'通过 %s' % result.success_count)
         if result.failure_count: status.append(u'失败 %s' % result.failure_count)
         if result.error_count:   status.append(u'错误 %s' % result.error_count  )
+        if result.notrun_count:  status.append(u'未执行 %s' % result.notrun_count)
         if status:
             status = ' '.join(status)
         else:
             status = 'none'
-        return [
+        attrs = [
             (u'开始时间', startTime),
             (u'运行时长', duration),
             (u'状态', status),
         ]
+        if result.notrun_count:
+            attrs.append((u'提前结束', self._stop_reason(result)))
+        stats = self.screenshot_stats
+        if stats['thumbnail'] or stats['dropped']:
+            attrs.append((u'截图', u'超出截图预算，%s 张改为缩略图，%s 张未保存' %
+                          (stats['thumbnail'], stats['dropped'])))
+        return attrs
+
+    def _stop_reason(self, result):
+        if self.max_failures and result.failure_count + result.error_count >= self.max_failures:
+            return u'失败和错误达到%s个，剩余用例未执行' % self.max_failures
+        if self.time_budget is not None and self.stopTime - self.startTime >= \
+                datetime.timedelta(seconds=self.time_budget):
+            return u'超过%s秒的时间预算，剩余用例未执行' % self.time_budget
+        return u'测试被中断，剩余用例未执行'
+
+    def _apply_screenshot_budget(self, result):
+        """
+        Keep the report's screenshots within screenshot_budget bytes, in
+        report order. Once the budget is spent, each further screenshot is
+        replaced by the encoder's thumbnail if that still fits, or dropped.
+        """
+        self.screenshot_stats = stats = dict(thumbnail=0, dropped=0)
+        if self.screenshot_budget is None:
+            return
+        spent = 0
+        for cls, cls_results in self.sortResult(result.result):
+            for n, t, o, e in cls_results:
+                imgs = getattr(t, 'imgs', None) or []
+                for i, img in enumerate(imgs):
+                    if not img:
+                        continue
+                    size = len(img) * 3 // 4
+                    if spent + size <= self.screenshot_budget:
+                        spent += size
+                        continue
+                    try:
+                        thumb = self.screenshot_encoder.thumbnail(base64.b64decode(img))
+                    except Exception:
+                        thumb = None
+                    if thumb is not None and spent + len(thumb) <= self.screenshot_budget:
+                        imgs[i] = base64.b64encode(thumb).decode('ascii')
+                        spent += len(thumb)
+                        stats['thumbnail'] += 1
+                    else:
+                        imgs[i] = None
+                        stats['dropped'] += 1
 
     def mkdir_json(self):
-        is_exists = os.path.exists(self.path)
-        # 判断结果
-        if not is_exists:
-            try:
-                # 如果不存在则创建目录
-                # 创建目录操作函数
-                with open(self.path, "w+") as f:
-                    f.write("var data = []")
-                return True
-            except Exception as e:
-                print(e)
-                return False
-        else:
+        """ Make sure the history log and its page index exist """
+        try:
+            self.history.ensure()
             return True
+        except (IOError, OSError) as e:
+            print(e)
+            return False
 
     def Write(self, title, heading, desc, data):
+        """ Append this run to the history """
+        description = dict()
+        description["startTime"] = heading[0][1]
+        description["duration"] = heading[1][1]
+        description["title"] = title
+        description["status"] = heading[2][1]
+        description["desc"] = desc
+        # structured per-test results, rendered by the page on demand
+        description["classes"] = data["classes"]
+        if data.get("modules"):
+            description["modules"] = data["modules"]
+        status = heading[2][1].split(" ")
+        for j in range(0, len(status)):
+            if status[j] == u"通过":
+                description["success"] = str(status[j + 1])
+            if status[j] == u"失败":
+                description["fail"] = str(status[j + 1])
+            if status[j] == u"错误":
+                description["error"] = str(status[j + 1])
+            if status[j] == u"未执行":
+                description["notrun"] = str(status[j + 1])
         try:
-            with open(self.path, "r+") as f:
-                all_data = f.read().split(" = ", 1)
-                data_json = all_data[1]
-                data_json = eval(data_json)
-                if len(data_json) >= 10:
-                    del data_json[0]
-                description = dict()
-                description["startTime"] = heading[0][1]
-                description["duration"] = heading[1][1]
-                if PY3K:
-                    description["title"] = title
-                    description["status"] = heading[2][1]
-                    description["desc"] = desc
-                    description["data"] = data
-                    status = heading[2][1].split(" ")
-                    for j in range(0, len(status)):
-                        if status[j] == "通过":
-                            description["success"] = str(status[j + 1])
-                        if status[j] == "失败":
-                            description["fail"] = str(status[j + 1])
-                        if status[j] == "错误":
-                            description["error"] = str(status[j + 1])
-                else:
-                    description["title"] = title.encode("utf-8")
-                    description["status"] = heading[2][1].encode("utf-8")
-                    description["desc"] = desc.encode("utf-8")
-                    description["data"] = data.encode("utf-8")
-                    status = heading[2][1].split(" ")
-                    for j in range(0, len(status)):
-                        if status[j] == u"通过":
-                            description["success"] = str(status[j + 1])
-                        if status[j] == u"失败":
-                            description["fail"] = str(status[j + 1])
-                        if status[j] == u"错误":
-                            description["error"] = str(status[j + 1])
-                data_json.append(description)
-                data_json = str(data_json)
-                f.seek(0)
-                f.truncate()
-                f.write(str("var data = " + data_json))
-        except IndexError:
-            sys.stderr.write("JSON初始化内容有误! 初始化内容’var data = []‘")
+            self.history.append(description)
+        except (IOError, OSError) as e:
+            print(e)
 
     def generateReport(self, test, result):
-        report_attrs = self.getReportAttributes(result)
+        with _span('_apply_screenshot_budget'):
+            self._apply_screenshot_budget(result)
+        with _span('getReportAttributes'):
+            report_attrs = self.getReportAttributes(result)
         generator = 'HTMLTestRunner %s' % __version__
-        stylesheet = self._generate_stylesheet()
+        with _span('_generate_assets'):
+            assets, stylesheet, script = self._generate_assets()
         heading = self._generate_heading(report_attrs)
-        report = self._generate_report(result)
+        streaming = self.streaming and self._can_stream()
+        with _span('_generate_report'):
+            report = None if streaming else self._generate_report(result)
         self.path = os.path.splitext(self.stream.name)[0] + ".json"
-        if self.mkdir_json():
-            self.Write(saxutils.escape(self.title), report_attrs, saxutils.escape(self.description), report)
-        ending = self._generate_ending()
-        chart = self._generate_chart(result)
-        output = self.HTML_TMPL % dict(
+        self.history = self._open_history()
+        # a shard's results go to the history once merged with the other shards
+        if not self.shard and self.mkdir_json():
+            with _span('_history_records', 'history'):
+                records = self._history_records(result)
+            with _span('Write', 'history'):
+                self.Write(saxutils.escape(self.title), report_attrs, saxutils.escape(self.description), records)
+        with _span('_generate_slowest'):
+            ending = self._generate_slowest(result) + self._generate_ending()
+        with _span('_generate_chart'):
+            chart = self._generate_chart(result)
+        html = dict(
             jsonpath = os.path.split(self.path)[1],
             title = saxutils.escape(self.title),
             generator = generator,
+            assets = assets,
             stylesheet = stylesheet,
+            script = script,
             heading = heading,
             report = report,
             ending = ending,
             chart_script = chart
         )
-        if PY3K:
-            self.stream.write(output.encode())
+        if streaming:
+            with _span('_stream_report'):
+                self._stream_report(html, result)
         else:
-            self.stream.write(output.encode('utf8'))
+            with _span('encode and write'):
+                self._write(self._template('HTML_TMPL') % html)
+
+    def _write(self, s):
+        self.stream.write(s.encode('utf8'))
+
+    def _can_stream(self):
+        return len(self._template('HTML_TMPL').split('report')) == 2 and \
+            len(self._report_template().split('test_list')) == 2
+
+    def _stream_report(self, html, result):
+        """
+        Write the page to self.stream piece by piece: everything before the
+        results table, then one row at a time, then the rest. Peak memory is
+        about one row instead of several copies of the whole report.
+        """
+        html_head, html_tail = self._template('HTML_TMPL').split('report')
+        report_head, report_tail = self._report_template().split('test_list')
+        summary = self._report_summary(result)
+        self._write(html_head % html)
+        self._write(report_head % summary)
+        for row in self._report_rows(result):
+            self._write(row)
+        self._write(report_tail % summary)
+        self._write(html_tail % html)
 
     def _generate_stylesheet(self):
-        return self.STYLESHEET_TMPL
+        return self._template('STYLESHEET_TMPL').text
+
+    def _generate_assets(self):
+        """ The (assets, stylesheet, script) parts of the page for self.assets """
+        stylesheet = self._generate_stylesheet()
+        script = self._template('SCRIPT_TMPL').text
+        if self.assets == 'cdn':
+            return (self._template('ASSETS_TMPL').text, stylesheet,
+                    self._template('SCRIPT_TAG_TMPL') % dict(script=script))
+        # the <style> blocks of STYLESHEET_TMPL become one asset, anything
+        # else in it (e.g. a <link>) stays in the page
+        css = _minify_css(u''.join(_STYLE_BLOCK.findall(stylesheet)))
+        rest = _STYLE_BLOCK.sub(u'', stylesheet).strip()
+        js = _minify_js(script)
+        libraries = [(os.path.basename(path), _read_asset(path)) for path in self.asset_files]
+        names = [name.lower() for name, data in libraries]
+        if not any(name.startswith('echarts') and name.endswith('.js') for name in names):
+            sys.stderr.write(u'assets=%r 但asset_files中没有本地的echarts，报告中不显示图表\n' % self.assets)
+        if not any(name.startswith('bootstrap') and name.endswith('.css') for name in names):
+            sys.stderr.write(u'assets=%r 但asset_files中没有本地的bootstrap css，报告没有样式\n' % self.assets)
+        if self.assets == 'inline':
+            tags = [self._inline_asset(name, data.decode('utf-8')) for name, data in libraries]
+            return (u'\n    '.join(tags), self._inline_asset('report.css', css) + rest,
+                    self._inline_asset('report.js', js))
+        tags = [self._asset_tag(name, data) for name, data in libraries]
+        return (u'\n    '.join(tags), self._asset_tag('report.css', css.encode('utf-8')) + rest,
+                self._asset_tag('report.js', js.encode('utf-8')))
+
+    @staticmethod
+    def _inline_asset(name, text):
+        if name.endswith('.css'):
+            return u'<style type="text/css" media="screen">%s</style>' % text
+        return u'<script type="text/javascript">%s</script>' % text.replace(u'</script', u'<\\/script')
+
+    def _asset_tag(self, name, data):
+        """ A tag linking the asset name with content data, written to asset_dir if it is not there yet """
+        url = saxutils.quoteattr(self._report_url(self._write_asset(name, data)))
+        if name.endswith('.css'):
+            return u'<link rel="stylesheet" href=%s>' % url
+        return u'<script type="text/javascript" src=%s charset="utf-8"></script>' % url
+
+    def _write_asset(self, name, data):
+        """
+        Store data in asset_dir as name with a hash of the content in it, e.g.
+        report.1f2e3d4c5b6a.css, and return its path. A changed asset gets a
+        new name, so reports never link a copy they were not written with,
+        and an asset is written once for all the reports sharing the directory.
+        """
+        asset_dir = self.asset_dir or os.path.join(os.path.dirname(os.path.abspath(self.stream.name)), 'assets')
+        stem, ext = os.path.splitext(name)
+        path = os.path.join(asset_dir, '%s.%s%s' % (stem, hashlib.sha1(data).hexdigest()[:12], ext))
+        if not os.path.exists(path):
+            if not os.path.isdir(asset_dir):
+                os.makedirs(asset_dir)
+            fd, tmp = tempfile.mkstemp(dir=asset_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            _replace_file(tmp, path)
+        return path
 
     def _generate_heading(self, report_attrs):
         a_lines = []
+        attribute_tmpl = self._template('HEADING_ATTRIBUTE_TMPL')
         for name, value in report_attrs:
-            line = self.HEADING_ATTRIBUTE_TMPL % dict(
+            line = attribute_tmpl % dict(
                 name = saxutils.escape(name),
                 value = saxutils.escape(value),
             )
             a_lines.append(line)
-        heading = self.HEADING_TMPL % dict(
+        heading = self._template('HEADING_TMPL') % dict(
             title = saxutils.escape(self.title),
             parameters = ''.join(a_lines),
-            description = saxutils.escape(self.description)
+            description = saxutils.escape(self.description),
+            history_size = self.history_size,
         )
         return heading
 
     def _generate_report(self, result):
-        rows = []
+        report_dict = self._report_summary(result)
+        report_dict['test_list'] = ''.join(self._report_rows(result))
+        return self._report_template() % report_dict
+
+    def _report_template(self):
+        if self.report_mode == 'virtual':
+            return self._template('VIRTUAL_REPORT_TMPL')
+        return self._template('REPORT_TMPL')
+
+    def _report_rows(self, result):
+        if self.report_mode == 'virtual':
+            rows = self._generate_virtual_rows(result)
+        else:
+            rows = self._generate_report_rows(result)
+        return self.compress and self._chunked_rows(rows) or rows
+
+    def _chunked_rows(self, rows):
+        """ Yield rows while self._chunks takes their long outputs """
+        directory = os.path.splitext(self.stream.name)[0] + '.chunks'
+        self._chunks = _ChunkWriter(directory, self._report_url(directory), self.chunk_size)
+        try:
+            for row in rows:
+                yield row
+            self._chunks.flush()
+        finally:
+            self._chunks = None
+
+    def _report_summary(self, result):
+        """ Return the report template variables other than test_list """
+        executed = result.success_count + result.failure_count + result.error_count
+        summary = dict(
+            count = str(executed + result.notrun_count),
+            Pass = str(result.success_count),
+            fail = str(result.failure_count),
+            error = str(result.error_count),
+            passrate = str("%.2f%%" % (executed and float(result.success_count) / executed * 100)),
+            notrun_button = result.notrun_count and self._template('NOTRUN_BUTTON_TMPL') % dict(notrun=result.notrun_count) or '',
+            duration = self._duration_text(self._total_duration(result)),
+        )
+        if self.report_mode == 'virtual':
+            summary['classes'] = self._virtual_classes(result)
+        return summary
+
+    @staticmethod
+    def _script_json(obj):
+        """ Serialize obj as JSON that is safe to embed in a <script> block """
+        s = json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+        return s.replace(u'</', u'<\\/').replace(u'\u2028', u'\\u2028').replace(u'\u2029', u'\\u2029')
+
+    def _virtual_classes(self, result):
+        """ Return the classes of the virtual table as JSON: [description, passed, failed, errors, duration, not run] """
+        classes = []
+        for cls, cls_results in self.sortResult(result.result):
+            counts = [0, 0, 0, 0]
+            for n, t, o, e in cls_results:
+                counts[n] += 1
+            duration = self._class_duration(result, cls, cls_results)
+            classes.append([self._class_desc(cls)] + counts[:3] + [round(duration, 6), counts[3]])
+        return self._script_json(classes)
+
+    def _generate_virtual_rows(self, result):
+        """ Yield the tests of the virtual table as JSON array items, in report order """
+        for cid, (cls, cls_results) in enumerate(self.sortResult(result.result)):
+            for tid, (n, t, o, e) in enumerate(cls_results):
+                shots = [self._screenshot_src(img) for img in getattr(t, 'imgs', None) or [] if img]
+                log = getattr(t, 'output_log', None)
+                duration = getattr(t, 'duration', None)
+                output = self._result_output(n, t, o, e)
+                if self._chunks is not None and len(output) > self.CHUNK_MIN:
+                    # [chunk url, key], loaded by vtDetail
+                    key = '%d.%d' % (cid, tid)
+                    output = [self._chunks.add(key, output), key]
+                test = [cid, self._test_desc(t), n, output, shots,
+                        log and self._report_url(log) or None,
+                        duration is not None and round(duration, 6) or duration]
+                yield self._script_json(test) + u',\n'
+
+    def _generate_report_rows(self, result):
+        """ Yield the rows of the results table, a class row followed by its test rows """
         sortedResult = self.sortResult(result.result)
+        class_tmpl = self._template('REPORT_CLASS_TMPL')
         for cid, (cls, cls_results) in enumerate(sortedResult):
             # subtotal for a class
-            np = nf = ne = 0
+            np = nf = ne = nn = 0
             for n,t,o,e in cls_results:
                 if n == 0: np += 1
                 elif n == 1: nf += 1
-                else: ne += 1
+                elif n == 2: ne += 1
+                else: nn += 1
 
-            # format class description
-            if cls.__module__ == "__main__":
-                name = cls.__name__
-            else:
-                name = "%s.%s" % (cls.__module__, cls.__name__)
-            doc = cls.__doc__ and cls.__doc__.split("\n")[0] or ""
-            desc = doc and '%s: %s' % (name, doc) or name
-
-            row = self.REPORT_CLASS_TMPL % dict(
+            duration = self._class_duration(result, cls, cls_results)
+            row = class_tmpl % dict(
                 style = ne > 0 and 'errorClass' or nf > 0 and 'failClass' or 'passClass',
-                desc = desc,
-                count = np+nf+ne,
+                desc = self._class_desc(cls),
+                count = np+nf+ne+nn,
                 Pass = np,
                 fail = nf,
                 error = ne,
                 cid = 'c%s' % (cid+1),
+                seconds = '%.6f' % duration,
+                duration = self._duration_text(duration),
+                fixtures = self._fixture_text(result.fixture_times.get(_class_key(cls), {})),
             )
-            rows.append(row)
+            yield row
 
             for tid, (n,t,o,e) in enumerate(cls_results):
-                self._generate_report_test(rows, cid, tid, n, t, o, e)
-
-        report = self.REPORT_TMPL % dict(
-            test_list = ''.join(rows),
-            count = str(result.success_count+result.failure_count+result.error_count),
-            Pass = str(result.success_count),
-            fail = str(result.failure_count),
-            error = str(result.error_count),
-            passrate = str("%.2f%%" % (float(result.success_count) /
-                                     float(result.success_count + result.failure_count + result.error_count) * 100)
-                         ),
-        )
-        return report
+                rows = []
+                with _span('_generate_report_test'):
+                    self._generate_report_test(rows, cid, tid, n, t, o, e)
+                for row in rows:
+                    yield row
 
     def _generate_chart(self, result):
-        chart = self.ECHARTS_SCRIPT % dict(
+        chart = self._template('ECHARTS_SCRIPT') % dict(
             Pass=str(result.success_count),
             fail=str(result.failure_count),
             error=str(result.error_count),
         )
         return chart
 
-    def _generate_report_test(self, rows, cid, tid, n, t, o, e):
-        # e.g. 'pt1.1', 'ft1.1', etc
-        has_output = bool(o or e)
-        tid = (n == 0 and 'p' or 'f') + 't%s.%s' % (cid + 1, tid + 1)
+    def _class_desc(self, cls):
+        # format class description
+        if cls.__module__ == "__main__":
+            name = cls.__name__
+        else:
+            name = "%s.%s" % (cls.__module__, cls.__name__)
+        doc = cls.__doc__ and cls.__doc__.split("\n")[0] or ""
+        return doc and '%s: %s' % (name, doc) or name
+
+    def _test_desc(self, t):
         name = t.id().split('.')[-1]
         if self.verbosity > 1:
-            doc = t._testMethodDoc or ''
+            doc = getattr(t, '_testMethodDoc', None) or ''
         else:
             doc = ""
 
         desc = doc and ('%s: %s' % (name, doc)) or name
-        if not PY3K:
-            if isinstance(desc, str):
-                desc = desc.decode("utf-8")
-        tmpl = has_output and self.REPORT_TEST_WITH_OUTPUT_TMPL or self.REPORT_TEST_NO_OUTPUT_TMPL
+        return desc if PY3K else _unicode(desc)
+
+    # row id prefix by result code
+    _TID_PREFIX = {0: 'pt', 1: 'ft', 2: 'ft', 3: 'nt'}
+
+    @classmethod
+    def _test_tid(cls, n, cid, tid):
+        # e.g. 'pt1.1', 'ft1.1', 'nt1.1' (not run), etc
+        return '%s%d.%d' % (cls._TID_PREFIX[n], cid + 1, tid + 1)
+
+    def _history_records(self, result):
+        """
+        Return the per-test results saved with the history entry: for each
+        class its description and, per test, id, description, status,
+        duration and, for failures and errors, the end of the output and
+        traceback (this run's report is overwritten by the next run, so
+        links into it would point at the wrong rows).
+        """
+        classes = []
+        for cid, (cls, cls_results) in enumerate(self.sortResult(result.result)):
+            tests = []
+            for tid, (n, t, o, e) in enumerate(cls_results):
+                duration = getattr(t, 'duration', None)
+                record = dict(
+                    id=t.id(),
+                    desc=self._test_desc(t),
+                    status=n,
+                    duration=duration is not None and round(duration, 6) or 0,
+                )
+                if n in (1, 2) and (o or e):
+                    record['excerpt'] = self._excerpt(self._test_output(o, e))
+                if getattr(t, 'attempts', None):
+                    record['attempts'] = [dict(status=a['status'], duration=a['duration'] and round(a['duration'], 6))
+                                          for a in t.attempts]
+                if getattr(t, 'output_log', None):
+                    record['log'] = self._report_url(t.output_log)
+                if getattr(t, 'fixture_times', None):
+                    record['fixtures'] = self._round_times(t.fixture_times)
+                tests.append(record)
+            record = dict(desc=self._class_desc(cls), tests=tests,
+                          duration=round(self._class_duration(result, cls, cls_results), 6))
+            fixtures = result.fixture_times.get(_class_key(cls))
+            if fixtures:
+                record['fixtures'] = self._round_times(fixtures)
+            classes.append(record)
+        modules = dict((name, self._round_times(times))
+                       for name, times in self._module_fixtures(result).items())
+        return dict(classes=classes, modules=modules)
+
+    # characters of output kept per failed test in the history
+    EXCERPT_SIZE = 2000
+
+    @classmethod
+    def _excerpt(cls, output):
+        """ The end of output, where the traceback is, at most EXCERPT_SIZE characters """
+        if len(output) <= cls.EXCERPT_SIZE:
+            return output
+        return u'...' + output[-cls.EXCERPT_SIZE:]
+
+    @staticmethod
+    def _round_times(times):
+        return dict((name, round(seconds, 6)) for name, seconds in times.items())
+
+    @staticmethod
+    def _duration_text(seconds):
+        return seconds is None and '-' or '%.3fs' % seconds
+
+    @staticmethod
+    def _fixture_text(times):
+        """ Fixture durations as text, e.g. 'setUp 0.010s, tearDown 0.002s' """
+        if not times:
+            return ''
+        return ', '.join('%s %.3fs' % (name, times[name]) for name in sorted(times))
+
+    @staticmethod
+    def _class_duration(result, cls, cls_results):
+        """ Time spent in a class: its tests plus setUpClass/tearDownClass """
+        duration = sum(getattr(t, 'duration', None) or 0 for n, t, o, e in cls_results)
+        return duration + sum(result.fixture_times.get(_class_key(cls), {}).values())
+
+    @staticmethod
+    def _module_fixtures(result):
+        """ The setUpModule/tearDownModule timings, by module name """
+        return dict((key, times) for key, times in result.fixture_times.items()
+                    if all(name in _FixtureTimer.MODULE_FIXTURES for name in times))
+
+    def _total_duration(self, result):
+        duration = sum(getattr(t, 'duration', None) or 0 for n, t, o, e in result.result)
+        return duration + sum(sum(times.values()) for times in result.fixture_times.values())
+
+    def _generate_report_test(self, rows, cid, tid, n, t, o, e):
+        tid = self._test_tid(n, cid, tid)
+        if o or e or getattr(t, 'attempts', None):
+            tmpl = self._template('REPORT_TEST_WITH_OUTPUT_TMPL')
+            script = self._template('REPORT_TEST_OUTPUT_TMPL') % dict(
+                id=tid,
+                output=saxutils.escape(self._result_output(n, t, o, e)),
+            )
+            if getattr(t, 'output_log', None):
+                script += self._template('OUTPUT_LOG_TMPL') % dict(
+                    href=saxutils.quoteattr(self._report_url(t.output_log)))
+            if self._chunks is not None and len(script) > self.CHUNK_MIN:
+                script = self._template('CHUNK_TMPL') % dict(
+                    url=saxutils.quoteattr(self._chunks.add(tid, script)), key=saxutils.quoteattr(tid))
+        else:
+            tmpl = self._template('REPORT_TEST_NO_OUTPUT_TMPL')
+            script = u''
+        # 未完成的截图占位为None，不显示
+        shots = [img for img in getattr(t, 'imgs', None) or () if img]
+        if shots:
+            # 判断截图列表，如果有则追加
+            tmp = []
+            for i, img in enumerate(shots):
+                display = i == 0 and 'block' or 'none'
+                if self.screenshot_dir:
+                    tmp.append(self._template('IMG_FILE_TMPL') % dict(src=self._save_screenshot(img),
+                                                                       display=display))
+                else:
+                    tmp.append(self._template('IMG_INLINE_TMPL') % dict(img=img, display=display,
+                                                                         mime=_image_mime(img)))
+            imgs = self._template('IMG_TMPL') % dict(imgs=u''.join(tmp))
+        else:
+            imgs = u"""无截图"""
+
+        duration = getattr(t, 'duration', None)
+        row = tmpl % dict(
+            tid=tid,
+            Class=(n in (0, 3) and 'hiddenRow' or 'none'),
+            style=self.CASE_STYLE[n],
+            desc=self._test_desc(t),
+            script=script,
+            status=self._status_text(n, t),
+            img=imgs,
+            seconds='%.6f' % (duration or 0),
+            duration=self._duration_text(duration),
+            fixtures=self._fixture_text(getattr(t, 'fixture_times', None)),
+        )
+        rows.append(row)
 
+    def _status_text(self, n, t):
+        attempts = getattr(t, 'attempts', None)
+        if attempts:
+            return u'%s(重试%d次)' % (self.STATUS[n], len(attempts))
+        return self.STATUS[n]
+
+    def _result_output(self, n, t, o, e):
+        """ The output of a test, after that of the earlier attempts folded into its row """
+        output = self._test_output(o, e)
+        attempts = getattr(t, 'attempts', None)
+        if not attempts:
+            return output
+        attempts = attempts + [dict(status=n, duration=getattr(t, 'duration', None), output=output)]
+        attempt_tmpl = self._template('RETRY_ATTEMPT_TMPL')
+        return u''.join(attempt_tmpl % dict(
+            attempt=i + 1,
+            status=self.STATUS[a['status']],
+            duration=self._duration_text(a['duration']),
+            output=a['output'],
+        ) for i, a in enumerate(attempts))
+
+    def _screenshot_src(self, img):
+        """ Return the <img> src of a base64 screenshot """
+        if self.screenshot_dir:
+            return self._save_screenshot(img)
+        return u'data:%s;base64,%s' % (_image_mime(img), img)
+
+    @staticmethod
+    def _test_output(o, e):
+        """ Return the captured output and traceback of a test as one unicode string """
         # o and e should be byte string because they are collected from stdout and stderr?
+        if PY3K:
+            return o + e
         if isinstance(o, str):
             # uo = unicode(o.encode('string_escape'))
-            if PY3K:
-                uo = o
-            else:
-                uo = o.decode('utf-8', 'ignore')
+            uo = o.decode('utf-8', 'ignore')
         else:
             uo = o
         if isinstance(e, str):
             # ue = unicode(e.encode('string_escape'))
-            if PY3K:
-                ue = e
-            elif e.find("Error") != -1 or e.find("Exception") != -1:
+            if e.find("Error") != -1 or e.find("Exception") != -1:
                 es = e.decode('utf-8', 'ignore').split('\n')
                 es[-2] = es[-2].decode('unicode_escape')
                 ue = u"\n".join(es)
@@ -1278,38 +4765,60 @@ class HTMLTestRunner(Template_mixin):
                 ue = e.decode('utf-8', 'ignore')
         else:
             ue = e
+        return uo + ue
 
-        script = self.REPORT_TEST_OUTPUT_TMPL % dict(
-            id=tid,
-            output=saxutils.escape(uo + ue),
-        )
-        if getattr(t,'imgs',[]):
-            # 判断截图列表，如果有则追加
-            tmp = u""
-            for i, img in enumerate(t.imgs):
-                if i==0:
-                    tmp+=""" <img src="data:image/jpg;base64,%s" style="display: block;" class="img"/>\n""" % img
-                else:
-                    tmp+=""" <img src="data:image/jpg;base64,%s" style="display: none;" class="img"/>\n""" % img
-            imgs = self.IMG_TMPL % dict(imgs=tmp)
-        else:
-            imgs = u"""无截图"""
+    def _save_screenshot(self, img):
+        """
+        Store a base64 screenshot in screenshot_dir under the hash of its
+        content and return its URL relative to the report. Identical
+        screenshots are written once, also across runs sharing the directory.
+        """
+        data = base64.b64decode(img)
+        name = hashlib.sha1(data).hexdigest() + _image_ext(data)
+        if name not in self._saved_screenshots:
+            path = os.path.join(self.screenshot_dir, name)
+            if not os.path.exists(path):
+                if not os.path.isdir(self.screenshot_dir):
+                    os.makedirs(self.screenshot_dir)
+                # write then replace, so a concurrent run never sees half a
+                # file, and one saving the same screenshot first is no error
+                fd, tmp = tempfile.mkstemp(dir=self.screenshot_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                _replace_file(tmp, path)
+            self._saved_screenshots.add(name)
+        return self._report_url(os.path.join(self.screenshot_dir, name))
 
-        row = tmpl % dict(
-            tid=tid,
-            Class=(n == 0 and 'hiddenRow' or 'none'),
-            style=n == 2 and 'errorCase' or (n == 1 and 'failCase' or 'passCase'),
-            desc=desc,
-            script=script,
-            status=self.STATUS[n],
-            img=imgs,
-        )
-        rows.append(row)
-        if not has_output:
-            return
+    def _report_url(self, path):
+        """ Return the URL of a file relative to the report """
+        report_dir = os.path.dirname(os.path.abspath(getattr(self.stream, 'name', '.')))
+        return '/'.join(os.path.relpath(os.path.abspath(path), report_dir).split(os.sep))
+
+    def _generate_slowest(self, result):
+        """ List the self.slowest slowest tests, and classes or module fixtures """
+        if not self.slowest or not result.result:
+            return ''
+        tests = []
+        classes = []
+        for cls, cls_results in self.sortResult(result.result):
+            for n, t, o, e in cls_results:
+                tests.append((getattr(t, 'duration', None) or 0, t.id(), getattr(t, 'fixture_times', None) or {}))
+            classes.append((self._class_duration(result, cls, cls_results), self._class_desc(cls),
+                            result.fixture_times.get(_class_key(cls), {})))
+        for name, times in self._module_fixtures(result).items():
+            classes.append((sum(times.values()), u'模块 %s' % name, times))
+
+        def rows(items):
+            items = sorted(items, key=lambda item: -item[0])[:self.slowest]
+            return ''.join(self._template('SLOWEST_ROW_TMPL') % dict(
+                desc=saxutils.escape(desc),
+                duration=self._duration_text(duration),
+                fixtures=self._fixture_text(fixtures) or '-',
+            ) for duration, desc, fixtures in items)
+        return self._template('SLOWEST_TMPL') % dict(tests=rows(tests), classes=rows(classes))
 
     def _generate_ending(self):
-        return self.ENDING_TMPL
+        return self._template('ENDING_TMPL').text
 
 
 ##############################################################################
@@ -1324,12 +4833,58 @@ class TestProgram(unittest.TestProgram):
     A variation of the unittest.TestProgram. Please refer to the base
     class for command line parameters.
     """
+    def __init__(self, *args, **kwargs):
+        # order='failed' or 'slow' reorders the tests, shard='i/n' runs part
+        # of them, see HTMLTestRunner
+        self.order = kwargs.pop('order', None)
+        self.shard = kwargs.pop('shard', None)
+        self.shard_durations = kwargs.pop('shard_durations', None)
+        self.shard_plan = kwargs.pop('shard_plan', None)
+        # paths of a JUnit XML report and a JSONL feed written as the tests run
+        self.junit_xml = kwargs.pop('junit_xml', None)
+        self.jsonl = kwargs.pop('jsonl', None)
+        unittest.TestProgram.__init__(self, *args, **kwargs)
+
+    def _getParentArgParser(self):
+        parser = unittest.TestProgram._getParentArgParser(self)
+        parser.add_argument('--order', dest='order', choices=['failed', 'slow'],
+                            help='Run recently failing (failed) or the longest (slow) tests first')
+        parser.add_argument('--shard', dest='shard', metavar='I/N',
+                            help='Run only the I-th of N duration-balanced parts of the tests')
+        parser.add_argument('--shard-durations', dest='shard_durations', metavar='PATH',
+                            help='History log (.history.jsonl) all shards balance their parts by')
+        parser.add_argument('--shard-plan', dest='shard_plan', metavar='DIGEST',
+                            help='Fail unless the tests are partitioned as DIGEST')
+        parser.add_argument('--junit-xml', dest='junit_xml', metavar='PATH',
+                            help='Also write a JUnit XML report to PATH')
+        parser.add_argument('--jsonl', dest='jsonl', metavar='PATH',
+                            help='Also write the results to PATH as JSON lines while the tests run')
+        return parser
+
     def runTests(self):
         # Pick HTMLTestRunner as the default test runner.
         # base class's testRunner parameter is not useful because it means
         # we have to instantiate HTMLTestRunner before we know self.verbosity.
+        sinks = []
+        if self.junit_xml:
+            sinks.append(JUnitSink(self.junit_xml))
+        if self.jsonl:
+            sinks.append(JsonlSink(self.jsonl))
         if self.testRunner is None:
-            self.testRunner = HTMLTestRunner(verbosity=self.verbosity)
+            self.testRunner = HTMLTestRunner(verbosity=self.verbosity, order=self.order, shard=self.shard,
+                                             shard_durations=self.shard_durations, shard_plan=self.shard_plan,
+                                             sinks=sinks)
+        elif isinstance(self.testRunner, HTMLTestRunner):
+            if self.order:
+                self.testRunner.order = self.order
+            if self.shard:
+                self.testRunner.shard = _parse_shard(self.shard)
+            if self.shard_durations:
+                self.testRunner.shard_durations = self.shard_durations
+            if self.shard_plan:
+                self.testRunner.shard_plan = self.shard_plan
+            if sinks:
+                self.testRunner.sinks = list(self.testRunner.sinks) + sinks
         unittest.TestProgram.runTests(self)
 
 main = TestProgram
@@ -1339,4 +4894,15 @@ main = TestProgram
 ##############################################################################
 
 if __name__ == "__main__":
-    main(module=None)
+    if sys.argv[1:2] == ['recover']:
+        # python -m HTMLTestRunner_Chart recover <journal> [report]
+        recover_report(*sys.argv[2:4])
+    elif sys.argv[1:2] == ['worker']:
+        # HTMLTESTRUNNER_TOKEN=<token> python -m HTMLTestRunner_Chart worker <host:port>
+        _socket_worker(sys.argv[2])
+    elif sys.argv[1:2] == ['merge']:
+        # python -m HTMLTestRunner_Chart merge <report> <artifact>...
+        # exits 1 when a test of any shard failed, like a single run
+        sys.exit(not merge_shards(sys.argv[3:], sys.argv[2]).wasSuccessful())
+    else:
+        main(module=None)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the runner itself on synthetic suites, no browser or network.
+
+For each suite size it measures:
+
+* the per-test overhead of _TestResult over a buffered unittest.TestResult;
+* generateReport time, without the history write;
+* the history Write time;
+* the peak RSS;
+* the size of the report and history files.
+
+Each size runs in its own process so the peak RSS is its own. Results are
+saved as JSON; --compare prints the change against an earlier result file,
+e.g. one from the previous version.
+
+    python benchmarks/bench_runner.py --sizes 1000,10000 --save bench.json
+    python benchmarks/bench_runner.py --sizes 1000,10000 --save new.json --compare bench.json
+    python benchmarks/bench_runner.py --option report_mode='virtual' --screenshots 1
+"""
+import argparse
+import ast
+import base64
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import HTMLTestRunner_Chart as H  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# what makes up a configuration, and the metrics compared by --compare
+# (lower is better for all of them)
+CONFIG = ('tests', 'class_size', 'output', 'failure_ratio', 'subtests', 'screenshots', 'screenshot_bytes',
+          'options')
+METRICS = ('overhead_us', 'report_s', 'history_s', 'peak_rss_mb', 'report_bytes')
+
+
+def build_suite(config):
+    """
+    A suite of config['tests'] tests in classes of config['class_size'].
+    Every test prints config['output'] bytes, runs config['subtests']
+    subtests and attaches config['screenshots'] fake screenshots; a
+    config['failure_ratio'] share of them fail, every other one of those
+    with an error instead of a failure.
+    """
+    line = 'x' * 79 + '\n'
+    output = line * (config['output'] // len(line)) + 'x' * (config['output'] % len(line))
+    screenshot = base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'\0' * config['screenshot_bytes']).decode('ascii')
+
+    def setUp(self):
+        # _TestResult.startTest gives each test its imgs; a plain
+        # unittest.TestResult does not
+        self.imgs = getattr(self, 'imgs', [])
+
+    def make_test(index):
+        failing = _failing(config, index)
+
+        def test(self):
+            if output:
+                sys.stdout.write(output)
+            for i in range(config['subtests']):
+                with self.subTest(i=i):
+                    pass
+            for _ in range(config['screenshots']):
+                self.imgs.append(screenshot)
+            if failing:
+                if index % 2:
+                    raise ValueError('synthetic error %d' % index)
+                self.fail('synthetic failure %d' % index)
+        test.__doc__ = 'synthetic test %d' % index
+        return test
+
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    for start in range(0, config['tests'], config['class_size']):
+        names = {'setUp': setUp}
+        for index in range(start, min(start + config['class_size'], config['tests'])):
+            names['test_%06d' % index] = make_test(index)
+        cls = type('Bench%06d' % start, (unittest.TestCase,), names)
+        cls.__module__ = 'bench'
+        suite.addTest(loader.loadTestsFromTestCase(cls))
+    return suite
+
+
+def _failing(config, index):
+    """ Whether test index of a configuration fails on purpose """
+    ratio = config['failure_ratio']
+    return int((index + 1) * ratio) != int(index * ratio)
+
+
+def _check_baseline(config, result):
+    """ Raise unless the baseline run failed exactly where the suite fails on purpose """
+    problems = result.errors + result.failures
+    unexpected = [error for test, error in problems if 'synthetic' not in error]
+    expected = sum(1 for index in range(config['tests']) if _failing(config, index))
+    if unexpected or len(problems) != expected:
+        raise RuntimeError('the baseline run has %d failures and errors, %d expected:\n%s'
+                           % (len(problems), expected, unexpected and unexpected[0] or ''))
+
+
+def _run(suite, result):
+    """ Seconds it takes suite to run into result, with the progress dots silenced """
+    stdout0, stderr0 = sys.stdout, sys.stderr
+    devnull = sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        start = _timer()
+        suite(result)
+        return _timer() - start
+    finally:
+        sys.stdout, sys.stderr = stdout0, stderr0
+        devnull.close()
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def measure(config):
+    """ Measure one configuration in this process; return its metrics """
+    n = config['tests']
+    plain = executed = float('inf')
+    for _ in range(config['repeat']):
+        # the baseline captures output too, like unittest's --buffer
+        baseline = unittest.TestResult()
+        baseline.buffer = True
+        plain = min(plain, _run(build_suite(config), baseline))
+        _check_baseline(config, baseline)
+    del baseline
+    directory = tempfile.mkdtemp(prefix='bench_runner')
+    try:
+        path = os.path.join(directory, 'report.html')
+        with open(path, 'wb') as stream:
+            runner = H.HTMLTestRunner(stream=stream, verbosity=1, **config['options'])
+            for _ in range(config['repeat']):
+                result = H._TestResult(**runner._result_kwargs())
+                executed = min(executed, _run(build_suite(config), result))
+                if result.journal:
+                    result.journal.remove()
+            runner.stopTime = datetime.datetime.now()
+            history = []
+            write = runner.Write
+
+            def timed_write(*args):
+                start = _timer()
+                write(*args)
+                history.append(_timer() - start)
+            runner.Write = timed_write
+            start = _timer()
+            runner.generateReport(None, result)
+            report = _timer() - start
+        files = os.listdir(directory)
+        history_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in files
+                            if name.startswith('report.') and name != 'report.html')
+        return dict(
+            config,
+            plain_s=round(plain, 4),
+            run_s=round(executed, 4),
+            overhead_us=round((executed - plain) / n * 1e6, 2),
+            report_s=round(report - sum(history), 4),
+            history_s=round(sum(history), 4),
+            peak_rss_mb=_peak_rss_mb(),
+            report_bytes=os.path.getsize(path),
+            history_bytes=history_bytes,
+        )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(config):
+    return json.dumps([config.get(name) for name in CONFIG], sort_keys=True)
+
+
+def compare(results, baseline):
+    """ Print each metric of results next to the same configuration in baseline """
+    before = dict((_key(config), config) for config in baseline['configs'])
+    print('\n%-10s %-14s %14s %14s %8s' % ('tests', 'metric', 'baseline', 'current', 'change'))
+    for config in results['configs']:
+        old = before.get(_key(config))
+        if old is None:
+            print('%-10d (no baseline for this configuration)' % config['tests'])
+            continue
+        for metric in METRICS:
+            if old.get(metric) is None or config.get(metric) is None:
+                continue
+            change = (config[metric] - old[metric]) / float(old[metric]) * 100 if old[metric] else 0.0
+            print('%-10d %-14s %14s %14s %+7.1f%%' % (config['tests'], metric, old[metric], config[metric], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of tests, one configuration each')
+    parser.add_argument('--class-size', type=int, default=100, help='tests per TestCase class')
+    parser.add_argument('--output', dest='output_bytes', type=int, default=200,
+                        help='bytes each test prints')
+    parser.add_argument('--failure-ratio', type=float, default=0.05, help='share of tests that fail')
+    parser.add_argument('--subtests', type=int, default=0, help='subtests per test')
+    parser.add_argument('--screenshots', type=int, default=0, help='fake screenshots per test')
+    parser.add_argument('--screenshot-bytes', type=int, default=20 * 1024, help='bytes per fake screenshot')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each suite, the fastest is used for the overhead')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help="HTMLTestRunner keyword argument, e.g. report_mode='virtual'; repeatable")
+    parser.add_argument('--save', metavar='PATH', help='save the results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='compare with the results saved in PATH')
+    parser.add_argument('--one', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.one:
+        # a child process measuring one configuration
+        print(json.dumps(measure(json.loads(args.one))))
+        return
+
+    options = {}
+    for option in args.option:
+        name, value = option.split('=', 1)
+        options[name] = ast.literal_eval(value)
+    results = dict(version=H.__version__, commit=_git_commit(), python=platform.python_version(),
+                   platform=platform.platform(), time=datetime.datetime.now().isoformat(), configs=[])
+    print('%-10s %12s %12s %12s %12s %12s' % ('tests', 'overhead_us', 'report_s', 'history_s',
+                                              'peak_rss_mb', 'report_kb'))
+    for size in args.sizes.split(','):
+        config = dict(tests=int(size), class_size=args.class_size, output=args.output_bytes,
+                      failure_ratio=args.failure_ratio, subtests=args.subtests,
+                      screenshots=args.screenshots, screenshot_bytes=args.screenshot_bytes, options=options,
+                      repeat=args.repeat)
+        line = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--one', json.dumps(config)])
+        metrics = json.loads(line.decode().strip().splitlines()[-1])
+        results['configs'].append(metrics)
+        print('%-10d %12s %12s %12s %12s %12d' % (metrics['tests'], metrics['overhead_us'], metrics['report_s'],
+                                                  metrics['history_s'], metrics['peak_rss_mb'],
+                                                  metrics['report_bytes'] // 1024))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
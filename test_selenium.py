@@ -27,8 +27,8 @@
 from selenium import webdriver
 import unittest
 
-# from HTMLTestRunner_Chart import HTMLTestRunner
-from HTMLTestRunner_Chart import HTMLTestRunner
+# from HTMLTestRunner_Chart import HTMLTestRunner, capture_screenshot
+from HTMLTestRunner_Chart import HTMLTestRunner, capture_screenshot
 
 
 class case_01(unittest.TestCase):
@@ -42,8 +42,8 @@ class case_01(unittest.TestCase):
         cls.driver.quit()
 
     def add_img(self):
-        self.imgs.append(self.driver.get_screenshot_as_base64())
-        return True
+        # 截图在后台线程完成，驱动卡住时不会阻塞用例
+        return capture_screenshot(self)
 
     def setUp(self):
         # 在是python3.x 中，如果在这里初始化driver ，因为3.x版本 unittest 运行机制不同，会导致用力失败时截图失败